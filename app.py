@@ -1,362 +1,513 @@
 import streamlit as st
-import keras
-import cv2
 import numpy as np
-import google.generativeai as genai
 import time
 import requests
-import folium
-from streamlit_folium import st_folium
 import random
-import hashlib
-from supabase import create_client, Client
-from huggingface_hub import hf_hub_download
 import re
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from earth911 import DEFAULT_CACHE_TTLS, SPECIFIC_ITEMS, CircuitBreaker, Earth911Client, MaterialTable, all_specific_items
+from storage import ImageStore, UploadQueue
+from geo import GAZETTEER_URL, LocationIndex, ZipIndex
+from llm import AdmissionController, ResponseStore
+from inference import IMG_SIZE, BatchScheduler, class_names, classify_many, ImageRejectedError, PredictionCache, load_backend, model_version
+from pipeline import Locator, Predictor, generate_response, submit_contribution
+from startup import Startup
+from metrics import Metrics
+from cache import TieredCache
+from content import PAGE_CSS, STEP_CARDS, tips
+
+# TensorFlow, Gemini, Supabase and Folium are imported lazily so the page can render before they are loaded
 
 gemini_api_key = st.secrets["GEMINI_API_KEY"]
-base_url = 'http://api.earth911.com/'
 earth911_api_key = st.secrets["EARTH911_API_KEY"]
 WEBHOOK_URL = st.secrets["WEBHOOK_URL"]
 
-# Setting up supabase for the backend
-url = st.secrets["SUPABASE_URL"]
-key = st.secrets["SUPABASE_KEY"]
+# Stage timings and counters shared by every session, shown on the admin tab and exported in Prometheus format
+@st.cache_resource(show_spinner=False)
+def load_metrics():
+    metrics = Metrics(trace=st.secrets.get("TRACE_LOGS", False))
+    if st.secrets.get("METRICS_PORT"):
+        metrics.start_server(st.secrets["METRICS_PORT"], host=st.secrets.get("METRICS_HOST", "127.0.0.1"))
+    if st.secrets.get("METRICS_PATH"):
+        metrics.start_writer(st.secrets["METRICS_PATH"], interval=st.secrets.get("METRICS_INTERVAL_S", 15))
+    return metrics
+
+metrics = load_metrics()
 
-supabase: Client = create_client(url, key)
+# Setting up supabase for the backend
+@st.cache_resource(show_spinner=False)
+def load_supabase():
+    from supabase import create_client
+    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
 
 # Setting up Gemini Model
-genai.configure(api_key=gemini_api_key)
-
-gen_model = genai.GenerativeModel("gemini-2.5-flash")
-
-class_names = [
-    "Battery",
-    "Biological",
-    "Brown-glass",
-    "Cardboard",
-    "Clothes",
-    "Green-glass",
-    "Metal",
-    "Paper",
-    "Plastic",
-    "Shoes",
-    "Trash",
-    "White-glass"
-]
-
-tips = {
-    "Battery": [
-        "**Tip:** Be sure to safely wrap the batteries before disposing",
-        "**Tip:** Store the batteries in a cool, dry place",
-        "**Tip:** Check for any signs of bulging or damage before disposing",
-        "**Tip:** Drop the batteries to recycle within six months, ensuring they are bagged or taped"
-    ],
-    "Biological": [
-        "**Tip:** Compost food scraps and yard waste when possible",
-        "**Tip:** Never mix biological waste with recyclables",
-        "**Tip:** Use sealed bins to prevent odor and pests"
-    ],
-    "Brown-glass": [
-        "**Tip:** Rinse glass bottles before recycling",
-        "**Tip:** Remove any caps or lids",
-        "**Tip:** Only recycle whole bottles — broken glass may not be accepted"
-    ],
-    "Cardboard": [
-        "**Tip:** Flatten cardboard boxes to save space",
-        "**Tip:** Remove excess tape or labels",
-        "**Tip:** Do not recycle wax-coated or greasy cardboard (e.g. pizza boxes)"
-    ],
-    "Clothes": [
-        "**Tip:** Donate gently used clothing to charity or thrift stores",
-        "**Tip:** Recycle worn-out clothes through textile recycling programs",
-        "**Tip:** Do not place clothing in curbside bins unless your area accepts it"
-    ],
-    "Green-glass": [
-        "**Tip:** Rinse bottles to remove residue",
-        "**Tip:** Remove metal or plastic lids before recycling",
-        "**Tip:** Recycle only whole glass bottles, not shattered pieces"
-    ],
-    "Metal": [
-        "**Tip:** Rinse food and drink cans before recycling",
-        "**Tip:** Leave labels on — most facilities can remove them",
-        "**Tip:** Avoid recycling sharp or rusted metal in curbside bins"
-    ],
-    "Paper": [
-        "**Tip:** Recycle clean and dry paper only",
-        "**Tip:** Do not recycle paper with food stains, grease, or water damage",
-        "**Tip:** Staples and paper clips are okay — no need to remove them"
-    ],
-    "Plastic": [
-        "**Tip:** Rinse plastic containers before placing them in the bin",
-        "**Tip:** Check for recycling symbols #1 or #2 — most accepted curbside",
-        "**Tip:** Leave caps on unless otherwise instructed"
-    ],
-    "Shoes": [
-        "**Tip:** Donate usable shoes to shelters or reuse programs",
-        "**Tip:** Recycle worn-out shoes through brand take-back programs",
-        "**Tip:** Do not throw shoes in curbside recycling unless accepted"
-    ],
-    "Trash": [
-        "**Tip:** Place dirty, contaminated, or non-recyclable items in the trash",
-        "**Tip:** Avoid putting electronics, batteries, or hazardous waste in the trash",
-        "**Tip:** Try to reduce trash by reusing or composting when possible"
-    ],
-    "White-glass": [
-        "**Tip:** Rinse glass containers before recycling",
-        "**Tip:** Remove any plastic or metal lids",
-        "**Tip:** Recycle only whole glass bottles, not broken pieces"
-    ]
-}
-
-
-# Loading the classification model from HuggingFace
-@st.cache_resource
-def load_model():
-    model_path = hf_hub_download(repo_id="AIforGreat/TrashClassification", filename="trashClassifier.keras")
-    return keras.models.load_model(model_path)
+@st.cache_resource(show_spinner=False)
+def load_gemini():
+    import google.generativeai as genai
+    genai.configure(api_key=gemini_api_key)
+    return genai.GenerativeModel("gemini-2.5-flash")
 
-model = load_model()
+# One pooled keep-alive client shared by every session for all Earth911 calls
+@st.cache_resource
+def load_earth911_client():
+    client = Earth911Client(
+        earth911_api_key,
+        base_url=st.secrets.get("EARTH911_BASE_URL", "https://api.earth911.com/"),
+        timeouts=st.secrets.get("EARTH911_TIMEOUTS"),
+        retries=st.secrets.get("EARTH911_RETRIES", 2),
+        pool_size=st.secrets.get("EARTH911_MAX_WORKERS", 8),
+        breaker=CircuitBreaker(
+            failure_threshold=st.secrets.get("EARTH911_BREAKER_THRESHOLD", 5),
+            reset_timeout=st.secrets.get("EARTH911_BREAKER_RESET_S", 30)
+        )
+    )
+    metrics.register("earth911", client.stats)
+    return client
 
-# Image preprocessing / Making Predictions
-def predict(file):
-    img_np = np.asarray(bytearray(file.read()), dtype=np.uint8)
-    img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
-
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img = cv2.resize(img, (224, 224))
-
-    prediction = model.predict(np.array([img]) / 255.0)
-    index = np.argmax(prediction)
-    confidence = float(prediction[0][index]) * 100
-    return class_names[index], confidence
-
-# Generating the response from the Gemini LLM
-def generate_response(prediction, confidence):
-    prompt = f"""
-    You are a smart waste disposal assistant that helps users with their trash. You are going to get a prediction
-    from a CNN Model on what the object is and you have to analyze the following object and provide a clear, friendly response that includes: 
-
-    The classification: **Is this recyclable, compostable, or trash?** (Say only one — don't mention what it is *not*)  
-    Briefly explain why it fits in that category only if it is not trash. Focus only on why it belongs in that category — do not explain why it isn’t in the others.
-    A fun fact about the item (add an emoji if appropriate)  
-    If confidence is below 90%, let the user know that the the classification may be inaccurate  
-    A reminder: 📍 *To find where to dispose of this item, go to the Locations tab.*
-
-    If the object name is too broad, generalize it to the most common example:
-    - **Metal:** aluminum cans, steel cans  
-    - **Biological:** food scraps, leaves, fruits, rotten vegetables, moldy bread  
-    - **Trash:** dirty diapers, face masks, toothbrushes  
-
-    Do not tell the user to check with their local recycling center — that warning has already been provided.
-    
-    **Use first person POV for user engagement even if you are talking about the CNN Model**
-
-    Here is the object: **{prediction}**  
-    Here is the confidence score: **{confidence:.1f}%**
-    """
-
-    response = gen_model.generate_content(prompt)
-    return response
-
-# Real-time generation effect
-def stream_response(response):
-    for word in response.split(" "):
-        yield word + " "
-        time.sleep(0.08)
-
-# Get material ID for the specific item using Earth911 API
-@st.cache_data(show_spinner=False)
-def get_material_id(specific_item, api_key, base_url):
-    try:
-        response = requests.get(base_url + "/earth911.searchMaterials", params={
-            "api_key": api_key,
-            "query": specific_item
-        })
+earth911 = load_earth911_client()
 
-        result = response.json().get("result", [])
+# Earth911 responses, bounded in memory and shared with the other server processes on this host through SQLite
+@st.cache_resource
+def load_earth911_cache():
+    cache = TieredCache(
+        path=st.secrets.get("EARTH911_CACHE_PATH", "cache/earth911.sqlite3"),
+        max_entries=st.secrets.get("EARTH911_CACHE_SIZE", 2048),
+        ttls={**DEFAULT_CACHE_TTLS, **st.secrets.get("EARTH911_CACHE_TTLS", {})}
+    )
+    metrics.register("earth911_cache", cache.stats)
+    return cache
+
+
+# Loading the classification model from HuggingFace. MODEL_PATH or a pinned MODEL_REVISION that is already
+# cached locally skips the Hub check entirely
+@st.cache_resource(show_spinner=False)
+def download_model():
+    if st.secrets.get("MODEL_PATH"):
+        return st.secrets["MODEL_PATH"]
+
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.errors import LocalEntryNotFoundError
+
+    revision = st.secrets.get("MODEL_REVISION")
+    kwargs = {"repo_id": "AIforGreat/TrashClassification", "filename": "trashClassifier.keras", "revision": revision}
+    if revision:
+        try:
+            return hf_hub_download(**kwargs, local_files_only=True)
+        except LocalEntryNotFoundError:
+            pass
+    return hf_hub_download(**kwargs)
+
+@st.cache_resource(show_spinner=False)
+def load_model():
+    import keras
+    return keras.models.load_model(download_model())
+
+# Chooses between the full-precision Keras model and the int8 TFLite engine, either in this process or in a
+# pool of INFERENCE_WORKERS local processes that keep TensorFlow off the server's GIL
+@st.cache_resource(show_spinner=False)
+def load_inference_backend():
+    options = {
+        "calibration_dir": st.secrets.get("TFLITE_CALIBRATION_DIR"),
+        "min_agreement": st.secrets.get("TFLITE_MIN_AGREEMENT", 0.95),
+        "jit_compile": st.secrets.get("XLA_JIT", False)
+    }
+    if st.secrets.get("INFERENCE_WORKERS", 0):
+        from workers import ProcessBackend
+
+        backend = ProcessBackend(
+            st.secrets.get("INFERENCE_BACKEND", "keras"),
+            download_model(),
+            workers=st.secrets["INFERENCE_WORKERS"],
+            max_batch=max(st.secrets.get("BATCH_MAX_SIZE", 16), st.secrets.get("BULK_BATCH_SIZE", 32)),
+            intra_op_threads=st.secrets.get("INFERENCE_INTRA_OP_THREADS"),
+            cpu_affinity=st.secrets.get("INFERENCE_CPU_AFFINITY"),
+            **options
+        )
+        metrics.register("inference_workers", backend.stats)
+        return backend
+
+    return load_backend(
+        st.secrets.get("INFERENCE_BACKEND", "keras"),
+        download_model(),
+        load_model,
+        num_threads=st.secrets.get("TFLITE_NUM_THREADS"),
+        **options
+    )
 
-        if result and "material_id" in result[0]:
-            return result[0]["material_id"]
-        else:
-            st.warning("Please throw away trash through curbside pickup")
-            return None
+# Shared across sessions so concurrent "Analyze" clicks are grouped into one forward pass
+@st.cache_resource(show_spinner=False)
+def load_scheduler():
+    backend = load_inference_backend()
+    scheduler = BatchScheduler(
+        backend.predict,
+        max_batch_size=st.secrets.get("BATCH_MAX_SIZE", 16),
+        max_wait_ms=st.secrets.get("BATCH_MAX_WAIT_MS", 10),
+        # One batch in flight per worker process
+        workers=st.secrets.get("INFERENCE_WORKERS", 0) or 1
+    )
+    metrics.register("batch_scheduler", lambda: {"batches": scheduler.batches, "requests": scheduler.requests})
+    return scheduler
+
+# Results for images that were already analyzed, invalidated whenever the model artifact or engine changes
+@st.cache_resource(show_spinner=False)
+def load_prediction_cache():
+    cache = PredictionCache(
+        model_version(download_model(), load_inference_backend().name),
+        max_entries=st.secrets.get("PREDICTION_CACHE_SIZE", 1024),
+        path=st.secrets.get("PREDICTION_CACHE_PATH"),
+        max_rows=st.secrets.get("PREDICTION_CACHE_ROWS", 100_000)
+    )
+    metrics.register("prediction_cache", cache.stats)
+    return cache
+
+# One dummy batch so the first real request doesn't pay for kernel compilation
+def warm_up_model():
+    backend = load_inference_backend()
+    load_scheduler().submit(np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=backend.input_dtype))
+    load_predictor()
+
+# Image preprocessing / Making Predictions, shared with the benchmark through pipeline.py
+@st.cache_resource(show_spinner=False)
+def load_predictor():
+    return Predictor(
+        load_inference_backend(),
+        load_scheduler(),
+        load_prediction_cache(),
+        metrics,
+        max_bytes=st.secrets.get("MAX_UPLOAD_MB", 20) * 1024 * 1024,
+        max_pixels=st.secrets.get("MAX_IMAGE_MEGAPIXELS", 40) * 1_000_000
+    )
 
-    except requests.exceptions.RequestException as e:
-        st.error("Earth911 API request failed. Please report this on the About page.")
-        st.exception(e)
-        return None
+def predict(file):
+    return load_predictor().predict(file.getbuffer())
 
-# Get latitude, longitude coordinates from zip code using Earth911 API
-@st.cache_data(show_spinner=False)
-def get_postal_coordinates(zip_code, api_key, base_url):
-    try:
-        response = requests.get(base_url + "/earth911.getPostalData", params={
-            "api_key": api_key,
-            "country": "US",
-            "postal_code": zip_code
-        })
+# Gemini calls allowed at once across every session, sized to the API quota
+@st.cache_resource
+def load_gemini_limiter():
+    limiter = AdmissionController(
+        max_concurrent=st.secrets.get("GEMINI_MAX_CONCURRENT", 4),
+        rate_per_minute=st.secrets.get("GEMINI_RATE_PER_MINUTE"),
+        max_waiting=st.secrets.get("GEMINI_MAX_WAITING", 8),
+        max_wait=st.secrets.get("GEMINI_MAX_WAIT_S", 2.0)
+    )
+    metrics.register("gemini_admission", limiter.stats)
+    return limiter
+
+gemini_deadline = st.secrets.get("GEMINI_DEADLINE_S", 15)
+
+# Yields Gemini's text chunks as they are generated
+def gemini_stream(prompt):
+    response = load_gemini().generate_content(prompt, stream=True, request_options={"timeout": gemini_deadline})
+    for chunk in response:
+        if chunk.parts:
+            yield chunk.text
+
+# Gemini replies only depend on the class and the confidence band, so they are precomputed and reused
+@st.cache_resource(show_spinner=False)
+def load_response_store():
+    store = ResponseStore(
+        lambda prompt: load_gemini().generate_content(prompt, request_options={"timeout": gemini_deadline}).text,
+        generate_stream=gemini_stream,
+        path=st.secrets.get("RESPONSE_STORE_PATH", "cache/gemini_responses.json"),
+        variants=st.secrets.get("RESPONSE_VARIANTS", 3),
+        ttl=st.secrets.get("RESPONSE_TTL_HOURS", 168) * 3600,
+        limiter=load_gemini_limiter(),
+        deadline=gemini_deadline
+    )
+    store.start_refresher(class_names, interval=st.secrets.get("RESPONSE_REFRESH_MINUTES", 60) * 60)
+    metrics.register("responses", store.stats)
+    return store
+
+# Shows timings such as time-to-first-token, enabled with DEBUG in secrets or ?debug=1
+debug_mode = st.secrets.get("DEBUG", False) or st.query_params.get("debug") == "1"
+
+# Passes the chunks straight to st.write_stream and records the time to the first one and to the whole reply
+def stream_response(chunks):
+    start = time.perf_counter()
+    first = True
+    for chunk in chunks:
+        if first:
+            st.session_state["ttft"] = time.perf_counter() - start
+            metrics.observe("llm_first_token", st.session_state["ttft"])
+            first = False
+        yield chunk
+    metrics.observe("llm", time.perf_counter() - start)
+
+# Item names resolved to Earth911 material IDs, refreshed in the background
+@st.cache_resource
+def load_material_table():
+    table = MaterialTable(
+        earth911,
+        path=st.secrets.get("MATERIAL_TABLE_PATH", "cache/material_ids.json"),
+        ttl=st.secrets.get("MATERIAL_TABLE_TTL_DAYS", 30) * 24 * 3600
+    )
+    table.start_refresher(all_specific_items())
+    metrics.register("material_table", lambda: {"entries": len(table)})
+    return table
+
+material_table = load_material_table()
+
+# Offline ZIP centroids, so lookups never leave the process. Built from the Census Gazetteer on the first start
+# if the deployment didn't build it
+@st.cache_resource(show_spinner=False)
+def load_zip_index():
+    return ZipIndex.load(
+        st.secrets.get("ZIP_INDEX_PATH", "data/zip_centroids.npy"),
+        url=st.secrets.get("ZIP_INDEX_URL", GAZETTEER_URL)
+    )
 
-        result = response.json().get("result")
+# Shared by all sessions so the number of concurrent Earth911 lookups stays bounded
+@st.cache_resource
+def load_earth911_pool():
+    return ThreadPoolExecutor(max_workers=st.secrets.get("EARTH911_MAX_WORKERS", 8), thread_name_prefix="earth911")
 
-        if result and "latitude" in result and "longitude" in result:
-            return result["latitude"], result["longitude"]
-        else:
-            return None
+def report_earth911_error(e):
+    st.error("Earth911 API request failed. Please report this on the About page.")
+    st.exception(e)
 
-    except requests.exceptions.RequestException as e:
-        st.error("Earth911 API request failed. Please report this on the About page.")
-        st.exception(e)
-        return None
+# The Earth911 side of the request path (pipeline.py) with a snapshot of known drop-off sites, refreshed
+# in the background
+@st.cache_resource
+def load_locator():
+    location_index = LocationIndex(
+        path=st.secrets.get("LOCATION_INDEX_PATH", "cache/locations.sqlite3"),
+        ttl=st.secrets.get("LOCATION_INDEX_TTL_HOURS", 168) * 3600
+    )
+    locator = Locator(
+        earth911,
+        load_earth911_cache(),
+        load_zip_index(),
+        material_table,
+        location_index,
+        load_earth911_pool(),
+        metrics,
+        on_error=report_earth911_error,
+        search_radius=st.secrets.get("LOCATION_SEARCH_RADIUS", 50),
+        search_max_results=st.secrets.get("LOCATION_SEARCH_MAX_RESULTS", 50),
+        bulk_details=st.secrets.get("EARTH911_BULK_DETAILS", False)
+    )
+    location_index.start_refresher(locator.search, interval=st.secrets.get("LOCATION_REFRESH_MINUTES", 60) * 60)
+    metrics.register("location_index", lambda: {"sites": len(location_index)})
+    return locator
 
-# Search for drop-off centers for the item near user's location using Earth911 API
-@st.cache_data(show_spinner=False)
-def get_dropoff_locations(lat, lon, material_id, api_key, base_url):
+# Get material ID for the specific item, only searching Earth911 live for names the table doesn't know yet
+def get_material_id(specific_item):
     try:
-        response = requests.get(base_url + "/earth911.searchLocations", params={
-            "api_key": api_key,
-            "latitude": lat,
-            "longitude": lon,
-            "material_id": material_id,
-            "max_distance": 20,
-            "max_results": 5
-        })
-
-        result = response.json().get("result", [])
-        if result:
-            return result
-        else:
-            return None
-
+        material_id = load_locator().material_id(specific_item)
     except requests.exceptions.RequestException as e:
-        st.error("Earth911 API request failed. Please report this on the About page.")
-        st.exception(e)
+        report_earth911_error(e)
         return None
 
+    if material_id is None:
+        st.warning("Please throw away trash through curbside pickup")
+    return material_id
 
-# Get the drop-off centers' location details to display to the users
-@st.cache_data(show_spinner=False)
-def get_location_details(api_key, id):
+# Get latitude, longitude coordinates from zip code
+def get_postal_coordinates(zip_code):
     try:
-        response = requests.get(base_url + "/earth911.getLocationDetails", params={
-            "api_key": api_key,
-            "location_id": id
-        })
-
-        return response.json()["result"]
-
+        return load_locator().postal_coordinates(zip_code)
     except requests.exceptions.RequestException as e:
-        st.error("Earth911 API request failed. Please report this on the About page.")
-        st.exception(e)
+        report_earth911_error(e)
         return None
 
-# Generate a unique hash based on the bytes
-def get_hash(bytes):
-    hasher = hashlib.sha256()
-    hasher.update(bytes)
-    return hasher.hexdigest()
-
-# Uploads the image to supabase if the image does not already exist
-def upload_misclassified_image(image, true_class, mime_type):
-    image_bytes = image.read()
-    new_hash = get_hash(image_bytes)
-    new_filename = f"{new_hash}.jpg"
-    path = f"Tmisclassified-images/{true_class}/{new_filename}"
+# Nearest drop-off centers for the item, or None if there are none
+def get_dropoff_locations(lat, lon, material_id, max_distance=20, max_results=5):
+    return load_locator().dropoff_locations(lat, lon, material_id, max_distance, max_results) or None
 
-    folders = supabase.storage.from_("misclassified-images").list("Tmisclassified-images")
-
-    #Check for duplicate across all folders
-    for folder in folders:
-        folder_name = folder['name'].strip("/")
-        files = supabase.storage.from_("misclassified-images").list(f"Tmisclassified-images/{folder_name}/")
-        for file in files:
-            if file["name"] == new_filename:
-                st.warning("Image already uploaded")
-                return
+# Yields each location's details as soon as its lookup finishes, giving up on the rest after the deadline
+def iter_location_details(ids, deadline):
+    return load_locator().iter_location_details(
+        ids, deadline, on_timeout=lambda: st.caption("Some locations took too long to load.")
+    )
 
-    supabase.storage.from_("misclassified-images").upload(path, image_bytes, {"content-type": mime_type})
+# Manifest of contributed image hashes, hydrated in the background at startup
+@st.cache_resource(show_spinner=False)
+def load_image_store():
+    store = ImageStore(
+        load_supabase(),
+        table=st.secrets.get("MANIFEST_TABLE", "misclassified_image_hashes"),
+        near_duplicates=st.secrets.get("NEAR_DUPLICATE_ACTION", "reject") or None,
+        near_duplicate_radius=st.secrets.get("NEAR_DUPLICATE_RADIUS", 6)
+    )
+    # Times the Supabase calls the upload workers make
+    store.claim_many = metrics.timed("supabase_claim", store.claim_many)
+    store.upload_object = metrics.timed("supabase_upload", store.upload_object)
+    store.hydrate_in_background()
+    return store
+
+# Background workers that upload contributed images, spilling to a local journal while Supabase is unreachable
+@st.cache_resource(show_spinner=False)
+def load_upload_queue():
+    upload_queue = UploadQueue(
+        load_image_store(),
+        workers=st.secrets.get("UPLOAD_WORKERS", 2),
+        max_depth=st.secrets.get("UPLOAD_QUEUE_SIZE", 100),
+        retries=st.secrets.get("UPLOAD_RETRIES", 3),
+        journal_dir=st.secrets.get("UPLOAD_JOURNAL_DIR", "cache/upload_journal")
+    )
+    metrics.register("upload_queue", upload_queue.stats)
+    return upload_queue
+
+# Queues the image for upload to supabase if the image does not already exist
+def upload_misclassified_image(image_bytes, true_class, mime_type):
+    if not submit_contribution(load_image_store(), load_upload_queue(), metrics, image_bytes, true_class, mime_type):
+        st.warning("Image already uploaded")
+
+# Loads everything heavy in the background while the page renders. Analyze is enabled once the model is warm.
+# Defined after the loaders it runs
+@st.cache_resource(show_spinner=False)
+def start_up():
+    def import_tensorflow():
+        # Worker processes import it themselves, so the server process never has to
+        if not st.secrets.get("INFERENCE_WORKERS", 0):
+            import tensorflow
+
+    return Startup([
+        ("import tensorflow", import_tensorflow),
+        ("download model", download_model),
+        ("load model", load_inference_backend),
+        ("warm up model", warm_up_model),
+        ("connect gemini", load_response_store),
+        ("connect supabase", load_upload_queue),
+        ("load zip index", load_zip_index)
+    ])
+
+startup = start_up()
 
 # Basic settings for the website
 st.set_page_config("Green Bin", "assets/icon.png", layout="wide")
 st.logo("assets/logo.png", size="large", icon_image="assets/icon.png")
 st.image("assets/logo.png", width=200)
 
+# Operator metrics, only shown with ?admin=<ADMIN_TOKEN>
+admin_token = st.secrets.get("ADMIN_TOKEN")
+admin_mode = bool(admin_token) and hmac.compare_digest(st.query_params.get("admin", "").encode(), admin_token.encode())
+
+# Operator view of start-up timings and the background upload queue, which shows raw errors and queue internals
+if admin_mode:
+    with st.sidebar:
+        st.subheader("Start-up")
+        for phase, seconds, error in startup.report():
+            if error is not None:
+                st.caption(f"{phase}: failed ({error})")
+            elif seconds is None:
+                st.caption(f"{phase}: running")
+            else:
+                st.caption(f"{phase}: {seconds:.2f}s")
+
+        st.subheader("Upload queue")
+        upload_stats = load_upload_queue().stats()
+        st.metric("Queue depth", upload_stats["depth"])
+        st.metric("Waiting in journal", upload_stats["journal"])
+        st.metric("Failed uploads", upload_stats["failures"])
+        st.caption(f"{upload_stats['uploaded']} uploaded, {upload_stats['duplicates']} duplicates skipped")
+
 # Creating the separate tabs for each section
-tab1, tab2, tab3, tab4 = st.tabs([":material/home: Home", ":material/location_on: Locations", ":material/developer_guide: How to Use", ":material/info: About"])
-
-# Hides the Main Menu using CSS
-st.markdown(
-    """
-    <style>
-    #MainMenu {
-        visibility:hidden;
-    }
-""", unsafe_allow_html=True)
-
-# Sets a bg pattern using CSS and sets the height for the folium map
-st.markdown( """
-<style>
-[data-testid="stAppViewContainer"] {
-    background-image: radial-gradient(#444cf7 0.5px, #ffffff 0.5px);
-    background-size: 10px 10px;
-}
-
-[data-testid="stHeader"] {
-    background-color: rgba(0, 0, 0, 0);
-    background-image: radial-gradient(#444cf7 0.5px, rgba(255, 255, 255, 0.1) 0.5px);
-    background-size: 10px 10px;
-    z-index: 9999;
-}
-
-[data-testid="stHeaderLogo"] {
-    opacity: 1 !important;
-}
-
-iframe[title="streamlit_folium.st_folium"] {
-    height: 300px;
-}
-</style>
-""", unsafe_allow_html=True)
-
-# Sets the apps font using Google Fonts
-st.markdown("""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap');
-    html, body, [class*="css"] {
-        font-family: 'Inter', sans-serif !important;
-    }
-    </style>
-""", unsafe_allow_html=True)
-
-# Adds a hover effect on the buttons
-st.markdown(
-    """
-    <style>
-    div.stButton > button:hover {
-        transform: scale(1.015);
-        transition: transform 0.2s ease;
-    }
-    div.stButton > button {
-        transition: transform 0.2s ease;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
-
-# Hides the toolbar actions from the user
-st.markdown(
-    """
-    <style>
-    .stToolbarActions {
-        display: none !important;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+tab_names = [":material/home: Home", ":material/location_on: Locations", ":material/developer_guide: How to Use", ":material/info: About"]
+if admin_mode:
+    tab_names.append(":material/monitoring: Admin")
+tab1, tab2, tab3, tab4, *admin_tab = st.tabs(tab_names)
+
+if admin_mode:
+    with admin_tab[0]:
+        import pandas as pd
+
+        st.header("Metrics", anchor=False)
+        st.caption("Recent p50/p95/p99 per stage since this process started")
+        stages = metrics.summary()
+        if stages:
+            st.dataframe(pd.DataFrame(stages).set_index("stage").round(1), use_container_width=True)
+        else:
+            st.info("No requests recorded yet.")
+
+        st.subheader("Cache hit rates")
+        cache_stats = load_earth911_cache().stats()["endpoints"]
+        cache_cols = st.columns(max(1, len(cache_stats)))
+        for col, (endpoint, counts) in zip(cache_cols, cache_stats.items()):
+            col.metric(endpoint, f"{counts['hit_rate']:.0%}",
+                       help=f"{counts['memory_hits']} memory hits, {counts['shared_hits']} shared hits, "
+                            f"{counts['misses']} misses, {counts['coalesced']} coalesced")
+
+        st.subheader("Gemini")
+        response_stats = load_response_store().stats()
+        gemini_cols = st.columns(4)
+        gemini_cols[0].metric("Stored replies", f"{response_stats['hit_rate']:.0%}")
+        gemini_cols[1].metric("In flight", load_gemini_limiter().stats()["in_flight"])
+        gemini_cols[2].metric("Shed", response_stats["shed"], help=f"{response_stats['timeouts']} timed out, "
+                                                                   f"{response_stats['errors']} failed")
+        gemini_cols[3].metric("Fallback replies", response_stats["fallbacks"],
+                              help=f"{response_stats['interrupted']} live replies cut short")
+
+        st.subheader("Counters")
+        st.json(metrics.counters())
+        st.subheader("Components")
+        st.json(metrics.gauges())
+        st.download_button("Download Prometheus metrics", metrics.render(), "greenbin_metrics.prom", "text/plain")
+
+# The page's CSS, written once per run from a string built once per process
+st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+
+# Polls until the model is warm, then reruns the app so the Analyze button turns on
+@st.fragment(run_every=1)
+def wait_for_model():
+    if startup.done("warm up model"):
+        st.rerun()
+    st.caption("Warming up the model...")
+
+
+# Classifies the photo and streams the reply. Returns the result to keep in session state, or None if the
+# image was rejected
+def analyze(image, toast_tip):
+    st.image(image, width=300)
+    image.seek(0)
+    try:
+        with st.spinner("Sorting Trash..."):
+            # Uses the predict function to get the prediction, and conf score of the model
+            model_prediction, confidence = predict(image)
+            # Generates the response form the LLM
+            gen_model_text = generate_response(load_response_store(), model_prediction, confidence)
+            st.write(f"**Confidence: {confidence:.2f}%**")
+            # Uses the write_stream function to create a real-time generation effect
+            text = st.write_stream(stream_response(gen_model_text))
+    except ImageRejectedError as e:
+        st.warning(str(e))
+        return None
 
+    return {
+        "image": image.getvalue(),
+        "mime_type": image.type,
+        "prediction": model_prediction,
+        "confidence": confidence,
+        "text": text,
+        "ttft": st.session_state.get("ttft"),
+        "tip": random.choice(tips.get(model_prediction)),
+        "toast_tip": toast_tip
+    }
 
-with tab1:
+# Redraws the last result, so it doesn't vanish when something else on the page reruns
+def show_analysis(analysis):
+    st.image(analysis["image"], width=300)
+    st.write(f"**Confidence: {analysis['confidence']:.2f}%**")
+    st.write(analysis["text"])
+    if debug_mode and analysis["ttft"] is not None:
+        st.caption(f"Time to first token: {analysis['ttft'] * 1000:.0f} ms")
+
+    # The tip toast and the balloons only show right after the analysis
+    celebrate = st.session_state.pop("celebrate", False)
+    if not analysis["toast_tip"]:
+        # Displays a random tip
+        st.info(analysis["tip"], icon="💡")
+    elif celebrate:
+        st.toast(analysis["tip"], icon="💡")
+    if celebrate:
+        st.balloons()
+
+
+# Upload, analysis and result. Interacting with these widgets only reruns this panel
+@st.fragment
+def analysis_panel():
     col1, col2 = st.columns(2)
 
     # Allows users to upload/take a picture of the item
@@ -365,49 +516,162 @@ with tab1:
         st.divider()
         enable = st.toggle("Enable camera")
         picture = st.camera_input("Take a picture", disabled=not enable)
-        predict_button = st.button("Analyze :brain:", use_container_width=True)
-
+        predict_button = st.button("Analyze :brain:", use_container_width=True,
+                                   disabled=not startup.done("warm up model"))
 
     with col2:
         if predict_button:
             if uploaded_file and picture:
                 st.warning("Please only provide one image")
-            elif uploaded_file:
-                st.image(uploaded_file, width=300)
-                uploaded_file.seek(0)
-                with st.spinner("Sorting Trash..."):
-                    # Uses the predict function to get the prediction, and conf score of the model
-                    model_prediction, confidence = predict(uploaded_file)
-                    # Generates the response form the LLM
-                    gen_model_text = generate_response(model_prediction, confidence)
-                    st.write(f"**Confidence: {confidence:.2f}%**")
-                    # Uses the write_stream function to create a real-time generation effect
-                    st.write_stream(stream_response(gen_model_text.text))
-                    st.session_state["model_prediction"] = model_prediction
-                item_tips = tips.get(model_prediction)
-                # Displays a random tip
-                st.info(random.choice(item_tips), icon="💡")
-                st.balloons()
-            elif picture:
-                st.image(picture, width=300)
-                with st.spinner("Sorting Trash..."):
-                    model_prediction, confidence = predict(picture)
-                    gen_model_text = generate_response(model_prediction, confidence)
-                    st.write(f"**Confidence: {confidence:.2f}%**")
-                    st.write_stream(stream_response(gen_model_text.text))
-                    st.session_state["model_prediction"] = model_prediction
-                item_tips = tips.get(model_prediction)
-                st.toast(random.choice(item_tips), icon="💡")
-                st.balloons()
+            elif uploaded_file or picture:
+                with metrics.request("analyze"):
+                    analysis = analyze(uploaded_file or picture, toast_tip=not uploaded_file)
+                if analysis is not None:
+                    # The image is kept too, so the Locations tab can contribute it if the prediction was wrong
+                    st.session_state["analysis"] = analysis
+                    st.session_state["model_prediction"] = analysis["prediction"]
+                    st.session_state["celebrate"] = True
+                    # The Locations tab depends on the prediction, so this is the one interaction that reruns the app
+                    st.rerun()
             else:
                 st.warning("Please provide an image")
+        elif "analysis" in st.session_state:
+            show_analysis(st.session_state["analysis"])
+
+
+# Sorts a whole batch of photos at once, e.g. from a bin audit
+@st.fragment
+def bulk_panel():
+    with st.expander("Bulk classification"):
+        bulk_files = st.file_uploader("Select images", type=["jpg", "jpeg", "png"], accept_multiple_files=True)
+        if st.button("Classify all", disabled=not (bulk_files and startup.done("warm up model"))):
+            import pandas as pd
+
+            progress = st.progress(0.0)
+            table = st.empty()
+            rows = []
+            batch_size = st.secrets.get("BULK_BATCH_SIZE", 32)
+            for file, class_name, confidence, error in classify_many(
+                [(file.name, file.getbuffer) for file in bulk_files],
+                load_inference_backend(),
+                batch_size=batch_size,
+                workers=st.secrets.get("BULK_WORKERS", 4),
+                max_bytes=st.secrets.get("MAX_UPLOAD_MB", 20) * 1024 * 1024,
+                max_pixels=st.secrets.get("MAX_IMAGE_MEGAPIXELS", 40) * 1_000_000
+            ):
+                rows.append({"file": file, "class": class_name, "confidence": confidence, "error": error})
+                # Streams the results into the table one batch at a time
+                if len(rows) % batch_size == 0 or len(rows) == len(bulk_files):
+                    progress.progress(len(rows) / len(bulk_files))
+                    table.dataframe(pd.DataFrame(rows), use_container_width=True)
+            progress.empty()
+            table.empty()
+            st.session_state["bulk_results"] = pd.DataFrame(rows)
+
+        if "bulk_results" in st.session_state:
+            bulk_results = st.session_state["bulk_results"]
+            st.dataframe(bulk_results, use_container_width=True)
+            csv_col, parquet_col = st.columns(2)
+            csv_col.download_button("Download CSV", bulk_results.to_csv(index=False), "greenbin_results.csv",
+                                    "text/csv", use_container_width=True)
+            parquet_col.download_button("Download Parquet", bulk_results.to_parquet(index=False),
+                                        "greenbin_results.parquet", "application/octet-stream",
+                                        use_container_width=True)
 
 
-with tab2:
-    st.header("Drop Off Locations :package:")
+with tab1:
+    if not startup.done("warm up model"):
+        wait_for_model()
+    analysis_panel()
+    bulk_panel()
+
+
+# Draws the map and each location's details. `details` can be a generator, so a new search shows
+# each location as soon as it arrives
+def show_locations(coordinates, details):
+    import folium
+    from streamlit_folium import st_folium
+
+    # Sets the Folium Map
+    first_coord = coordinates[0]
+    map = folium.Map(location=[first_coord["latitude"], first_coord["longitude"]], zoom_start=8)
+
+    # Adds all the locations and details on the map
+    for loc in coordinates:
+        folium.Marker(
+            location=(loc["latitude"], loc["longitude"]),
+            popup=loc["description"],
+            tooltip=loc["description"],
+            icon=folium.Icon(icon="recycle", prefix="fa", color="blue")
+        ).add_to(map)
+
+    with st.container():
+        # Displays the Map
+        st_folium(map, use_container_width=True, returned_objects=[], key="locations_map")
+
+        for location in details:
+            # Displays the information in an expander for each location
+            with st.expander(location["description"]):
+                st.write(f"**Address**: {location['address']}")
+                st.write(f"**Hours**: {location['hours']}")
+                st.write(f"**Phone**: {location['phone']}")
+                st.write(f"**Website**: [{location['url']}]({location['url']})")
+
+# Looks up the drop-off centers and shows them in `results_col`. Returns what to keep in session state
+def search_locations(results_col, specific_item, search_radius, result_count):
+    if not (len(st.session_state.zip_code) == 5 and st.session_state.zip_code.isdigit()):
+        st.warning("Please enter a valid 5-digit ZIP code.")
+        return None
 
-    tab4_col1, tab4_col2 = st.columns(2)
+    coordinates = get_postal_coordinates(st.session_state.zip_code)
+    if coordinates is None:
+        st.warning("ZIP code not found. Please enter a valid U.S. ZIP code.")
+        return None
+
+    with st.spinner("Searching for locations..."):
+        # Stores the analyzed image in supabase if the prediction was incorrect and the user allowed it
+        if st.session_state.prediction_correct == "No" and st.session_state.allow_images:
+            analysis = st.session_state["analysis"]
+            upload_misclassified_image(analysis["image"], st.session_state.user_select.lower(), analysis["mime_type"])
+
+        lat, lon = coordinates
+        st.session_state.submitted = True
+
+        # Gets the material id for the item
+        material_id = get_material_id(specific_item)
+        if material_id is None:
+            return None
+
+        # Gets the drop-off centers location details
+        locations = get_dropoff_locations(lat, lon, material_id, search_radius, result_count)
+        if locations is None:
+            st.warning("No nearby locations accept this item.")
+            return None
+
+        # Stores the information for each location in list
+        coordinates = [
+            {"latitude": float(loc["latitude"]), "longitude": float(loc["longitude"]),
+             "description": loc["description"], "location_id": loc["location_id"]}
+            for loc in locations
+        ]
 
+        # Gets the information of the drop-off locations concurrently and shows each one as it arrives
+        details = []
+
+        def collect():
+            ids = [loc["location_id"] for loc in coordinates]
+            for item in iter_location_details(ids, st.secrets.get("EARTH911_DETAILS_DEADLINE_S", 8)):
+                details.append(item)
+                yield item
+
+        with results_col:
+            show_locations(coordinates, collect())
+        return {"coordinates": coordinates, "details": details}
+
+
+# The Locations form and map. Typing a ZIP code or changing a selection only reruns this panel
+@st.fragment
+def locations_panel():
     if "zip_code" not in st.session_state:
         st.session_state["zip_code"] = ""
     if "prediction_correct" not in st.session_state:
@@ -419,183 +683,100 @@ with tab2:
     if "allow_images" not in st.session_state:
         st.session_state["allow_images"] = False
 
-    # All the items in Earth911 database
-    specific_items = {
-        "Battery": ["Alkaline Batteries", "Button Cell Batteries", "Car Batteries", "Lead-acid Batteries",
-                    "Lithium Batteries", "Lithium-ion Batteries", "Marine Batteries", "Nickel-cadmium Batteries",
-                    "Nickel-metal Hydride Batteries", "Nickel-zinc Batteries", "Silver-oxide Batteries",
-                    "Zinc-air Batteries", "Zinc-carbon Batteries"],
-        "Plastic": ["#1 Plastic Bags", "#1 Plastic Trays", "#2 Plastic Clamshells", "#3 Plastic Bags", "#4 Plastic Bags",
-                    "#5 Plastic Bottles", "#5 Rigid Plastics", "#6 Plastic Cups", "#7 Plastic Bags", "#1 Plastic Beverage Bottles",
-                    "#1 Rigid Plastics", "#2 Plastic Film", "#3 Plastic Bottles", "#4 Plastic Bottles", "#5 Plastic Caps",
-                    "#6 Plastic - Expanded", "#6 Plastic Cups - Expanded", "#7 Plastic Bottles", "#1 Plastic Clamshells", "#2 Plastic Bags",
-                    "#2 Plastic Jugs - Clear", "#3 Plastic Film", "#4 Plastic Film", "#5 Plastic Clamshells", "#6 Plastic Bags",
-                    "#6 Plastic Film", "#7 Plastic Film", "#1 Plastic Film", "#2 Plastic Bottles", "#2 Plastic Jugs - Colored",
-                    "#3 Rigid Plastics", "#4 Rigid Plastics", "#5 Plastic Cups", "#6 Plastic Bottles", "#6 Plastic Peanuts",
-                    "#7 Rigid Plastics", "#1 Plastic Non-Beverage Bottles", "#2 Plastic Caps", "#2 Rigid Plastics", "#4 Flexible Plastics",
-                    "#5 Plastic Bags", "#5 Plastic Film", "#6 Plastic Clamshells", "#6 Rigid Plastics", "Acrylics"],
-        "Brown-glass": ["Brown Glass Beverage Containers", "Brown Glass Containers"],
-        "Green-glass": ["Green Glass Beverage Containers", "Green Glass Containers"],
-        "White-glass": ["Clear Glass Beverage Containers", "Clear Glass Containers"],
-        "Clothes": ["Clothing"],
-        "Shoes": ["Shoes"],
-        "Metal": ["Aerosol Cans - Full", "Aluminum Trays", "Refrigerators", "Aluminum Beverage Cans", "Ferrous Metals",
-                  "Steel Cans", "Aluminum Foil", "Metal Paint Cans", "Steel Lids", "Aluminum Food Cans",
-                  "Metal Tags", "Washer/Dryers", "Aluminum Pie Plates", "Nonferrous Metals"],
-        "Cardboard": ["Cardboard"],
-        "Paper": ["Corrugated Cardboard", "Multi-wall Paper Bags", "Paper Sleeves", "Drink Boxes", "Newspaper",
-                  "Paperback Books", "Envelopes", "Office Paper", "Paperboard", "Magazines",
-                  "Paper Cups", "Phone Books", "Mixed Paper", "Paper Labels", "Wet-strength Paperboard"],
-        "Biological": ["Organic Food Waste"],
-        "Trash": ["Trash"]
-    }
+    tab4_col1, tab4_col2 = st.columns(2)
 
     with tab4_col1:
-        if "model_prediction" in st.session_state:
-            # Obtaining the information from the user
-            st.session_state.zip_code = st.text_input("Enter your ZIP Code")
-            st.session_state.prediction_correct = st.radio("Was the prediction correct?", ("Yes", "No"))
-
-            # If the prediction was incorrect, users can choose to allow future training with their images
-            if st.session_state.prediction_correct == "No":
-                st.session_state.allow_images = st.checkbox("Allow training with my images",
-                                                            help="By enabling this, your image may help the AI get smarter over time.")
-                st.session_state.user_select = st.selectbox("What was the object?", class_names)
-            else:
-                st.session_state.user_select = st.session_state.model_prediction
-
-            # Users can choose a specific item in the category for the best results
-            specific_item = st.selectbox(
-                f"What type of {st.session_state.user_select.lower()}?",
-                specific_items[st.session_state.user_select], help="Choose what type of item"
-            )
-
-            if st.button("See Locations", use_container_width=True):
-                if len(st.session_state.zip_code) == 5 and st.session_state.zip_code.isdigit():
-                    coordinates = get_postal_coordinates(st.session_state.zip_code, earth911_api_key, base_url)
-                    if coordinates is None:
-                        st.warning("ZIP code not found. Please enter a valid U.S. ZIP code.")
-                    else:
-                        with st.spinner("Searching for locations..."):
-                            # Checks if the prediction was incorrect and stores the image in supabase using upload_misclassified_image function
-                            if st.session_state.prediction_correct == "No":
-                                if st.session_state.allow_images:
-                                    if uploaded_file:
-                                        mime_type = uploaded_file.type
-                                        upload_misclassified_image(uploaded_file, st.session_state.user_select.lower(),
-                                                                   mime_type)
-                                    else:
-                                        mime_type = picture.type
-                                        upload_misclassified_image(picture, st.session_state.user_select.lower(), mime_type)
-
-                            lat, lon = coordinates
-                            st.session_state.submitted = True
-
-                            # Gets the material id for the item
-                            material_id = get_material_id(specific_item, earth911_api_key, base_url)
-                            if material_id is not None:
-                                # Gets the drop-off centers location details
-                                locations = get_dropoff_locations(lat, lon, material_id, earth911_api_key, base_url)
-
-                                # Stores the information for each location in list
-                                if locations is not None:
-                                    st.session_state["coordinates"] = [
-                                        {"latitude": float(loc["latitude"]), "longitude": float(loc["longitude"]),
-                                         "description": loc["description"], "location_id": loc["location_id"]}
-                                        for loc in locations
-                                    ]
-
-                                    # Sets the Folium Map
-                                    first_coord = st.session_state["coordinates"][0]
-                                    map = folium.Map(location=[first_coord["latitude"], first_coord["longitude"]],
-                                                     zoom_start=8)
-
-                                    ids = []
-
-                                    # Adds all the locations and details on the map
-                                    for loc in st.session_state["coordinates"]:
-                                        marker = loc["latitude"], loc["longitude"]
-                                        ids.append(loc["location_id"])
-                                        folium.Marker(
-                                            location=marker,
-                                            popup=loc["description"],
-                                            tooltip=loc["description"],
-                                            icon=folium.Icon(icon="recycle", prefix="fa", color="blue")
-                                        ).add_to(map)
-
-                                    with tab4_col2:
-                                        with st.container():
-                                            # Displays the Map
-                                            st_folium(map, use_container_width=True, returned_objects=[])
-
-                                            # Gets the information of the drop-off locations to display to the user
-                                            for location_id in ids:
-                                                result = get_location_details(api_key=earth911_api_key, id=location_id)
-                                                address = result[location_id]["address"]
-                                                name = result[location_id]["description"]
-                                                url = result[location_id]["url"]
-                                                phone = result[location_id]["phone"]
-                                                hours = result[location_id]["hours"]
-
-                                                # Displays the information in an expander for each location
-                                                with st.expander(name):
-                                                    st.write(f"**Address**: {address}")
-                                                    st.write(f"**Hours**: {hours}")
-                                                    st.write(f"**Phone**: {phone}")
-                                                    st.write(f"**Website**: [{url}]({url})")
-                                else:
-                                    st.warning("No nearby locations accept this item.")
-                else:
-                    st.warning("Please enter a valid 5-digit ZIP code.")
-        else:
+        if "model_prediction" not in st.session_state:
             st.warning("Please upload an image on the Home page")
+            return
+
+        # Obtaining the information from the user
+        st.session_state.zip_code = st.text_input("Enter your ZIP Code")
+        st.session_state.prediction_correct = st.radio("Was the prediction correct?", ("Yes", "No"))
+
+        # If the prediction was incorrect, users can choose to allow future training with their images
+        if st.session_state.prediction_correct == "No":
+            st.session_state.allow_images = st.checkbox("Allow training with my images",
+                                                        help="By enabling this, your image may help the AI get smarter over time.")
+            st.session_state.user_select = st.selectbox("What was the object?", class_names)
+        else:
+            st.session_state.user_select = st.session_state.model_prediction
+
+        # Users can choose a specific item in the category for the best results
+        specific_item = st.selectbox(
+            f"What type of {st.session_state.user_select.lower()}?",
+            SPECIFIC_ITEMS[st.session_state.user_select], help="Choose what type of item"
+        )
+
+        # Answered from the local location index, so changing these doesn't cost extra Earth911 calls
+        search_radius = st.slider("Search radius (miles)", 5, st.secrets.get("LOCATION_SEARCH_RADIUS", 50), 20, step=5)
+        result_count = st.slider("Number of locations", 1, 20, 5)
+
+        searched = st.button("See Locations", use_container_width=True)
+        if searched:
+            with metrics.request("locations"):
+                st.session_state["locations"] = search_locations(tab4_col2, specific_item, search_radius,
+                                                                 result_count)
+
+    # The last results stay on screen while the form is edited, without asking Earth911 again
+    results = st.session_state.get("locations")
+    if results and not searched:
+        with tab4_col2:
+            show_locations(results["coordinates"], results["details"])
+
+
+with tab2:
+    st.header("Drop Off Locations :package:")
+    locations_panel()
 
 with tab3:
     st.header(":recycle: How to Use", anchor=False)
 
     tab3_col1,tab3_col2 = st.columns(2)
 
-    steps = {
-        "Upload": "Take a photo of your item.",
-        "Advice": "See if it's recyclable, compostable, or trash.",
-        "Find": "Locate nearby recycling centers.",
-        "Dispose": "Reduce waste responsibly!",
-    }
-
-    # Displaying the steps using basic CSS for clean UI
-    for i, (title, desc) in enumerate(steps.items(), 1):
-        if i%2 != 0:
-            with tab3_col1:
-                st.markdown(f"""
-                    <div style='
-                        background-color:#DFF0D8; 
-                        padding:15px; 
-                        margin-bottom:10px; 
-                        border-radius:10px;
-                        box-shadow: 2px 2px 5px gray;'>
-                        <h3 style='margin:0; color:#3c763d;'>{i}: {title}</h3>
-                        <p style='font-size:20px; margin:5px 0 0 0;'>{desc}</p>
-                    </div>
-                """, unsafe_allow_html=True)
-        else:
-            with tab3_col2:
-                st.markdown(f"""
-                    <div style='
-                        background-color:#DFF0D8; 
-                        padding:15px; 
-                        margin-bottom:10px; 
-                        border-radius:10px;
-                        box-shadow: 2px 2px 5px gray;'>
-                        <h3 style='margin:0; color:#3c763d;'>{i}: {title}</h3>
-                        <p style='font-size:20px; margin:5px 0 0 0;'>{desc}</p>
-                    </div>
-                """, unsafe_allow_html=True)
+    for i, card in enumerate(STEP_CARDS):
+        with tab3_col1 if i % 2 == 0 else tab3_col2:
+            st.markdown(card, unsafe_allow_html=True)
 
     st.info(
         """**Important Note:** Our model only provides general recycling, composting, and trash recommendations based on common guidelines.
         Recycling rules vary by location, so check with local authorities for accuracy."""
     )
 
+# Basic regex pattern for email validation
+def is_valid_email(email):
+    email_pattern = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
+    return re.match(email_pattern, email) is not None
+
+# Basic contact form using make.com. Submitting it only reruns the form
+@st.fragment
+def contact_form():
+    with st.form("contact_form"):
+        name = st.text_input("First Name")
+        email = st.text_input("Email Address")
+        message = st.text_area("Your Message")
+        submit_button = st.form_submit_button("Send")
+
+    if not submit_button:
+        return
+
+    if not name:
+        st.warning("Please provide your name.")
+    elif not email:
+        st.warning("Please provide your email address.")
+    elif not is_valid_email(email):
+        st.warning("Please provide a valid email address.")
+    elif not message:
+        st.warning("Please provide a message.")
+    else:
+        data = {"email": email, "name": name, "message": message}
+        response = requests.post(WEBHOOK_URL, json=data)
+
+        if response.status_code == 200:
+            st.success("Your message has been sent successfully! 🎉")
+        else:
+            st.error("There was an error sending your message.")
+
 # About page | Provides more information about the app
 with tab4:
     st.header("About", anchor=False)
@@ -656,40 +837,4 @@ with tab4:
     st.markdown("**Contact Us**")
     st.markdown("Questions, feedback, or collaboration?")
 
-    # Basic contact form using make.com
-    def is_valid_email(email):
-        # Basic regex pattern for email validation
-        email_pattern = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-        return re.match(email_pattern, email) is not None
-
-
-    with st.form("contact_form"):
-        name = st.text_input("First Name")
-        email = st.text_input("Email Address")
-        message = st.text_area("Your Message")
-        submit_button = st.form_submit_button("Send")
-
-    if submit_button:
-        if not name:
-            st.warning("Please provide your name.")
-            st.stop()
-
-        if not email:
-            st.warning("Please provide your email address.")
-            st.stop()
-
-        if not is_valid_email(email):
-            st.warning("Please provide a valid email address.")
-            st.stop()
-
-        if not message:
-            st.warning("Please provide a message.")
-            st.stop()
-
-        data = {"email": email, "name": name, "message": message}
-        response = requests.post(WEBHOOK_URL, json=data)
-
-        if response.status_code == 200:
-            st.success("Your message has been sent successfully! 🎉")
-        else:
-            st.error("There was an error sending your message.")
+    contact_form()
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+# Two-tier cache for JSON-serializable API results: a bounded in-memory LRU in front of a SQLite file in WAL mode,
+# so every server process on the host reads what the others fetched. Entries expire per endpoint, and concurrent
+# misses for the same key in one process share a single load. `_lock` only guards the in-memory state: each thread
+# talks to SQLite through its own connection, so a slow or busy database never holds up memory hits
+class TieredCache:
+    def __init__(self, path=None, max_entries=2048, ttls=None, default_ttl=24 * 3600, purge_every=500):
+        self.max_entries = max_entries
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.purge_every = purge_every
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.path = path
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = self._connection()
+            # Readers in other processes aren't blocked while one writes
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                db.execute("""
+                    CREATE TABLE IF NOT EXISTS entries (
+                        key TEXT PRIMARY KEY,
+                        endpoint TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                """)
+
+    # This thread's connection, opened on first use. A busy database is waited on
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @staticmethod
+    def key(endpoint, args):
+        return f"{endpoint}:{json.dumps(args, sort_keys=True)}"
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint, self.default_ttl)
+
+    def _count(self, endpoint, name):
+        self._counts[endpoint][name] += 1
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # Looks in memory, then in SQLite. Returns (found, value) so a cached None is still a hit
+    def _lookup(self, endpoint, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._count(endpoint, "memory_hits")
+                    return True, entry[0]
+                del self._memory[key]
+
+        if self.path is None:
+            return False, None
+        row = self._connection().execute("SELECT value, expires_at FROM entries WHERE key = ? AND expires_at > ?",
+                                         (key, now)).fetchone()
+        if row is None:
+            return False, None
+        value = json.loads(row[0])
+        with self._lock:
+            self._remember(key, value, row[1])
+            self._count(endpoint, "shared_hits")
+        return True, value
+
+    def get(self, endpoint, args):
+        return self._lookup(endpoint, self.key(endpoint, args))[1]
+
+    def put(self, endpoint, args, value):
+        key = self.key(endpoint, args)
+        expires_at = time.time() + self.ttl(endpoint)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if self.path is None:
+            return
+        try:
+            db = self._connection()
+            with db:
+                db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                           (key, endpoint, json.dumps(value), expires_at))
+                if purge:
+                    db.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.OperationalError:
+            # Another process holding the lock for too long only costs this entry its shared copy
+            logger.warning("Could not write %s to the shared cache", key)
+
+    # Returns the cached value, or runs load() once however many threads miss the same key at the same time.
+    # Exceptions from load() reach every waiting caller and nothing is cached
+    def get_or_load(self, endpoint, args, load):
+        key = self.key(endpoint, args)
+        found, value = self._lookup(endpoint, key)
+        if found:
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self._count(endpoint, "misses")
+            else:
+                self._count(endpoint, "coalesced")
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.put(endpoint, args, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    # The cached values for whichever of `args_list` are present, keyed by their args
+    def get_many(self, endpoint, args_list):
+        found = {}
+        for args in args_list:
+            hit, value = self._lookup(endpoint, self.key(endpoint, args))
+            if hit:
+                found[args] = value
+            else:
+                with self._lock:
+                    self._count(endpoint, "misses")
+        return found
+
+    def stats(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, counts in self._counts.items():
+                hits = counts["memory_hits"] + counts["shared_hits"]
+                total = hits + counts["misses"] + counts["coalesced"]
+                endpoints[endpoint] = {
+                    **{name: counts[name] for name in ("memory_hits", "shared_hits", "misses", "coalesced")},
+                    "hit_rate": hits / total if total else 0.0
+                }
+            return {"entries": len(self._memory), "endpoints": endpoints}
@@ -0,0 +1,134 @@
+# Static page content, built once per process instead of on every rerun
+
+tips = {
+    "Battery": [
+        "**Tip:** Be sure to safely wrap the batteries before disposing",
+        "**Tip:** Store the batteries in a cool, dry place",
+        "**Tip:** Check for any signs of bulging or damage before disposing",
+        "**Tip:** Drop the batteries to recycle within six months, ensuring they are bagged or taped"
+    ],
+    "Biological": [
+        "**Tip:** Compost food scraps and yard waste when possible",
+        "**Tip:** Never mix biological waste with recyclables",
+        "**Tip:** Use sealed bins to prevent odor and pests"
+    ],
+    "Brown-glass": [
+        "**Tip:** Rinse glass bottles before recycling",
+        "**Tip:** Remove any caps or lids",
+        "**Tip:** Only recycle whole bottles — broken glass may not be accepted"
+    ],
+    "Cardboard": [
+        "**Tip:** Flatten cardboard boxes to save space",
+        "**Tip:** Remove excess tape or labels",
+        "**Tip:** Do not recycle wax-coated or greasy cardboard (e.g. pizza boxes)"
+    ],
+    "Clothes": [
+        "**Tip:** Donate gently used clothing to charity or thrift stores",
+        "**Tip:** Recycle worn-out clothes through textile recycling programs",
+        "**Tip:** Do not place clothing in curbside bins unless your area accepts it"
+    ],
+    "Green-glass": [
+        "**Tip:** Rinse bottles to remove residue",
+        "**Tip:** Remove metal or plastic lids before recycling",
+        "**Tip:** Recycle only whole glass bottles, not shattered pieces"
+    ],
+    "Metal": [
+        "**Tip:** Rinse food and drink cans before recycling",
+        "**Tip:** Leave labels on — most facilities can remove them",
+        "**Tip:** Avoid recycling sharp or rusted metal in curbside bins"
+    ],
+    "Paper": [
+        "**Tip:** Recycle clean and dry paper only",
+        "**Tip:** Do not recycle paper with food stains, grease, or water damage",
+        "**Tip:** Staples and paper clips are okay — no need to remove them"
+    ],
+    "Plastic": [
+        "**Tip:** Rinse plastic containers before placing them in the bin",
+        "**Tip:** Check for recycling symbols #1 or #2 — most accepted curbside",
+        "**Tip:** Leave caps on unless otherwise instructed"
+    ],
+    "Shoes": [
+        "**Tip:** Donate usable shoes to shelters or reuse programs",
+        "**Tip:** Recycle worn-out shoes through brand take-back programs",
+        "**Tip:** Do not throw shoes in curbside recycling unless accepted"
+    ],
+    "Trash": [
+        "**Tip:** Place dirty, contaminated, or non-recyclable items in the trash",
+        "**Tip:** Avoid putting electronics, batteries, or hazardous waste in the trash",
+        "**Tip:** Try to reduce trash by reusing or composting when possible"
+    ],
+    "White-glass": [
+        "**Tip:** Rinse glass containers before recycling",
+        "**Tip:** Remove any plastic or metal lids",
+        "**Tip:** Recycle only whole glass bottles, not broken pieces"
+    ]
+}
+
+
+# All of the page's CSS in one block: hides the main menu and toolbar actions, sets the background pattern, the font,
+# the button hover effect and the height of the folium map
+PAGE_CSS = """
+<style>
+@import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap');
+
+#MainMenu {
+    visibility:hidden;
+}
+
+[data-testid="stAppViewContainer"] {
+    background-image: radial-gradient(#444cf7 0.5px, #ffffff 0.5px);
+    background-size: 10px 10px;
+}
+
+[data-testid="stHeader"] {
+    background-color: rgba(0, 0, 0, 0);
+    background-image: radial-gradient(#444cf7 0.5px, rgba(255, 255, 255, 0.1) 0.5px);
+    background-size: 10px 10px;
+    z-index: 9999;
+}
+
+[data-testid="stHeaderLogo"] {
+    opacity: 1 !important;
+}
+
+iframe[title="streamlit_folium.st_folium"] {
+    height: 300px;
+}
+
+html, body, [class*="css"] {
+    font-family: 'Inter', sans-serif !important;
+}
+
+div.stButton > button:hover {
+    transform: scale(1.015);
+    transition: transform 0.2s ease;
+}
+div.stButton > button {
+    transition: transform 0.2s ease;
+}
+
+.stToolbarActions {
+    display: none !important;
+}
+</style>
+"""
+
+steps = {
+    "Upload": "Take a photo of your item.",
+    "Advice": "See if it's recyclable, compostable, or trash.",
+    "Find": "Locate nearby recycling centers.",
+    "Dispose": "Reduce waste responsibly!",
+}
+
+# The How to Use cards, using basic CSS for clean UI
+STEP_CARDS = [f"""
+    <div style='
+        background-color:#DFF0D8; 
+        padding:15px; 
+        margin-bottom:10px; 
+        border-radius:10px;
+        box-shadow: 2px 2px 5px gray;'>
+        <h3 style='margin:0; color:#3c763d;'>{i}: {title}</h3>
+        <p style='font-size:20px; margin:5px 0 0 0;'>{desc}</p>
+    </div>
+""" for i, (title, desc) in enumerate(steps.items(), 1)]
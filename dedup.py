@@ -0,0 +1,118 @@
+import threading
+
+import numpy as np
+
+# Perceptual fingerprints for spotting the same item photographed twice or re-encoded. Hashes are 64-bit ints
+# and similar images differ in only a few bits
+
+# Near-duplicates are at most this many bits apart by default
+DEFAULT_RADIUS = 6
+
+
+def _grayscale(image_bytes):
+    import cv2
+
+    # The fingerprint only needs a few dozen pixels, so libjpeg can decode at 1/8 scale
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None or min(img.shape) < 32:
+        img = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("Could not decode the image")
+    return img
+
+
+def _to_int(bits):
+    return int("".join("1" if bit else "0" for bit in bits.flatten()), 2)
+
+
+# DCT hash: whether each of the 8x8 lowest frequencies of a 32x32 thumbnail is above their median.
+# Survives re-encoding, resizing and small colour changes
+def phash(image_bytes):
+    import cv2
+
+    small = cv2.resize(_grayscale(image_bytes), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # The DC term is the overall brightness, which says nothing about the content
+    return _to_int(low > np.median(low.flatten()[1:]))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# Postgres bigint is signed, fingerprints are unsigned 64-bit
+def to_signed(fingerprint):
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def from_signed(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+# Burkhard-Keller tree over Hamming distance. A radius search only descends into children whose edge distance
+# is within `radius` of the query's distance to the node, which skips most of the tree
+class BKTree:
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def add(self, fingerprint, value):
+        self._size += 1
+        if self._root is None:
+            self._root = (fingerprint, value, {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(fingerprint, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (fingerprint, value, {})
+                return
+            node = child
+
+    # Every (distance, fingerprint, value) within `radius`, closest first
+    def search(self, fingerprint, radius):
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(fingerprint, node[0])
+            if distance <= radius:
+                found.append((distance, node[0], node[1]))
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return sorted(found, key=lambda item: item[0])
+
+    def __len__(self):
+        return self._size
+
+
+# Thread-safe fingerprint -> image hash index. BK-trees can't delete, so discarded images are skipped instead
+class NearDuplicateIndex:
+    def __init__(self, radius=DEFAULT_RADIUS):
+        self.radius = radius
+        self._tree = BKTree()
+        self._discarded = set()
+        self._lock = threading.Lock()
+
+    def add(self, fingerprint, image_hash):
+        with self._lock:
+            self._discarded.discard(image_hash)
+            self._tree.add(fingerprint, image_hash)
+
+    def discard(self, image_hash):
+        with self._lock:
+            self._discarded.add(image_hash)
+
+    # The closest indexed image within the radius as (image_hash, distance), or None
+    def find(self, fingerprint, exclude=None):
+        with self._lock:
+            for distance, _, image_hash in self._tree.search(fingerprint, self.radius):
+                if image_hash not in self._discarded and image_hash != exclude:
+                    return image_hash, distance
+        return None
+
+    def __len__(self):
+        return len(self._tree)
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://api.earth911.com/"
+
+# (connect, read) timeouts in seconds for each endpoint
+DEFAULT_TIMEOUTS = {
+    "searchMaterials": (3.05, 5),
+    "getPostalData": (3.05, 5),
+    "searchLocations": (3.05, 10),
+    "getLocationDetails": (3.05, 8)
+}
+
+# How long cached responses stay fresh, in seconds. ZIP centroids practically never move, site details do
+DEFAULT_CACHE_TTLS = {
+    "getPostalData": 30 * 24 * 3600,
+    "getLocationDetails": 24 * 3600
+}
+
+
+# All the items in Earth911 database
+SPECIFIC_ITEMS = {
+    "Battery": ["Alkaline Batteries", "Button Cell Batteries", "Car Batteries", "Lead-acid Batteries",
+                "Lithium Batteries", "Lithium-ion Batteries", "Marine Batteries", "Nickel-cadmium Batteries",
+                "Nickel-metal Hydride Batteries", "Nickel-zinc Batteries", "Silver-oxide Batteries",
+                "Zinc-air Batteries", "Zinc-carbon Batteries"],
+    "Plastic": ["#1 Plastic Bags", "#1 Plastic Trays", "#2 Plastic Clamshells", "#3 Plastic Bags", "#4 Plastic Bags",
+                "#5 Plastic Bottles", "#5 Rigid Plastics", "#6 Plastic Cups", "#7 Plastic Bags", "#1 Plastic Beverage Bottles",
+                "#1 Rigid Plastics", "#2 Plastic Film", "#3 Plastic Bottles", "#4 Plastic Bottles", "#5 Plastic Caps",
+                "#6 Plastic - Expanded", "#6 Plastic Cups - Expanded", "#7 Plastic Bottles", "#1 Plastic Clamshells", "#2 Plastic Bags",
+                "#2 Plastic Jugs - Clear", "#3 Plastic Film", "#4 Plastic Film", "#5 Plastic Clamshells", "#6 Plastic Bags",
+                "#6 Plastic Film", "#7 Plastic Film", "#1 Plastic Film", "#2 Plastic Bottles", "#2 Plastic Jugs - Colored",
+                "#3 Rigid Plastics", "#4 Rigid Plastics", "#5 Plastic Cups", "#6 Plastic Bottles", "#6 Plastic Peanuts",
+                "#7 Rigid Plastics", "#1 Plastic Non-Beverage Bottles", "#2 Plastic Caps", "#2 Rigid Plastics", "#4 Flexible Plastics",
+                "#5 Plastic Bags", "#5 Plastic Film", "#6 Plastic Clamshells", "#6 Rigid Plastics", "Acrylics"],
+    "Brown-glass": ["Brown Glass Beverage Containers", "Brown Glass Containers"],
+    "Green-glass": ["Green Glass Beverage Containers", "Green Glass Containers"],
+    "White-glass": ["Clear Glass Beverage Containers", "Clear Glass Containers"],
+    "Clothes": ["Clothing"],
+    "Shoes": ["Shoes"],
+    "Metal": ["Aerosol Cans - Full", "Aluminum Trays", "Refrigerators", "Aluminum Beverage Cans", "Ferrous Metals",
+              "Steel Cans", "Aluminum Foil", "Metal Paint Cans", "Steel Lids", "Aluminum Food Cans",
+              "Metal Tags", "Washer/Dryers", "Aluminum Pie Plates", "Nonferrous Metals"],
+    "Cardboard": ["Cardboard"],
+    "Paper": ["Corrugated Cardboard", "Multi-wall Paper Bags", "Paper Sleeves", "Drink Boxes", "Newspaper",
+              "Paperback Books", "Envelopes", "Office Paper", "Paperboard", "Magazines",
+              "Paper Cups", "Phone Books", "Mixed Paper", "Paper Labels", "Wet-strength Paperboard"],
+    "Biological": ["Organic Food Waste"],
+    "Trash": ["Trash"]
+}
+
+
+# Raised without touching the network while Earth911 is considered down
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+# Opens after `failure_threshold` failed calls in a row and lets a single trial call through after `reset_timeout`
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def end_trial(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Earth911 circuit opened after %d failures", self.failures)
+                self.opened_at = time.monotonic()
+
+
+# Keeps the most recent request durations per endpoint
+class LatencyStats:
+    def __init__(self, window=1000):
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._calls = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            self._durations[endpoint].append(seconds)
+            self._calls[endpoint] += 1
+            if error:
+                self._errors[endpoint] += 1
+
+    def summary(self):
+        with self._lock:
+            summary = {}
+            for endpoint, durations in self._durations.items():
+                ordered = sorted(durations)
+                summary[endpoint] = {
+                    "calls": self._calls[endpoint],
+                    "errors": self._errors[endpoint],
+                    "p50_ms": ordered[len(ordered) // 2] * 1000,
+                    "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+                    "max_ms": ordered[-1] * 1000
+                }
+            return summary
+
+
+# One pooled keep-alive session for every Earth911 call, with timeouts, jittered retries and a circuit breaker
+class Earth911Client:
+    def __init__(self, api_key, base_url=BASE_URL, timeouts=None, retries=2, backoff=0.3, pool_size=10,
+                 breaker=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/") + "/"
+        self.timeouts = {**DEFAULT_TIMEOUTS, **{k: tuple(v) for k, v in (timeouts or {}).items()}}
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # Calls earth911.<endpoint> and returns the decoded JSON body
+    def get(self, endpoint, **params):
+        if not self.breaker.allow():
+            raise CircuitOpenError("Earth911 is unavailable right now")
+        # Whatever ends the call, a half-open trial is over. Errors that aren't Earth911's (e.g. a bug handling the
+        # response) would otherwise keep the breaker open for good
+        try:
+            return self._get(endpoint, params)
+        finally:
+            self.breaker.end_trial()
+
+    def _get(self, endpoint, params):
+        url = f"{self.base_url}earth911.{endpoint}"
+        timeout = self.timeouts.get(endpoint, (3.05, 10))
+
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params={"api_key": self.api_key, **params}, timeout=timeout)
+                # Rate limits and server errors are worth retrying, other client errors are not
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.exceptions.HTTPError(f"{response.status_code} from {endpoint}", response=response)
+                response.raise_for_status()
+                data = response.json()
+            except requests.exceptions.HTTPError as e:
+                self.latency.record(endpoint, time.perf_counter() - start, error=True)
+                if e.response is not None and e.response.status_code < 500 and e.response.status_code != 429:
+                    self.breaker.record_success()
+                    raise
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise
+            except requests.exceptions.RequestException:
+                self.latency.record(endpoint, time.perf_counter() - start, error=True)
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise
+            else:
+                self.latency.record(endpoint, time.perf_counter() - start)
+                self.breaker.record_success()
+                return data
+
+            # Exponential backoff with full jitter so retries from many sessions don't line up
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def stats(self):
+        return {"circuit": self.breaker.state, "endpoints": self.latency.summary()}
+
+
+# Persisted item name -> Earth911 material ID table, so searchMaterials only runs for names it hasn't seen
+class MaterialTable:
+    def __init__(self, client, path=None, ttl=30 * 24 * 3600):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                logger.warning("Could not read the material table at %s, starting empty", path)
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.time() - entry["resolved_at"] < self.ttl
+
+    # Runs the free-text search. No match is stored as None, request failures raise
+    def _search(self, name):
+        result = self.client.get("searchMaterials", query=name).get("result", [])
+        if result and "material_id" in result[0]:
+            return result[0]["material_id"]
+        return None
+
+    def _store(self, name, material_id, save=True):
+        with self._lock:
+            self._entries[name] = {"material_id": material_id, "resolved_at": time.time()}
+            if save:
+                self._save()
+
+    # Returns the material ID (None if Earth911 has no match), searching live only on a miss.
+    # A stale entry is still returned if the live search fails
+    def get(self, name):
+        entry = self._entries.get(name)
+        if self._is_fresh(entry):
+            return entry["material_id"]
+        try:
+            material_id = self._search(name)
+        except Exception:
+            if entry is None:
+                raise
+            return entry["material_id"]
+        self._store(name, material_id)
+        return material_id
+
+    # Resolves every missing or stale name concurrently and writes the table once at the end
+    def resolve_all(self, names, max_workers=8, force=False):
+        pending = [name for name in names if force or not self._is_fresh(self._entries.get(name))]
+        failed = []
+
+        def resolve(name):
+            try:
+                self._store(name, self._search(name), save=False)
+            except Exception:
+                logger.exception("Could not resolve the material ID for %s", name)
+                failed.append(name)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(resolve, pending))
+
+        with self._lock:
+            self._save()
+        return len(pending) - len(failed), failed
+
+    # Resolves the table now and again every `interval` seconds on a daemon thread
+    def start_refresher(self, names, interval=24 * 3600):
+        if self._refresher is not None:
+            return
+
+        def run():
+            while True:
+                self.resolve_all(names)
+                time.sleep(interval)
+
+        self._refresher = threading.Thread(target=run, name="material-table-refresher", daemon=True)
+        self._refresher.start()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Every item name the Locations tab offers
+def all_specific_items():
+    return sorted({item for items in SPECIFIC_ITEMS.values() for item in items})
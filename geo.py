@@ -0,0 +1,262 @@
+import io
+import os
+import csv
+import math
+import time
+import sqlite3
+import logging
+import zipfile
+import threading
+import urllib.request
+from collections import defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_MILES = 3958.8
+
+# One fixed-width record per ZIP code, sorted by zip so lookups are a binary search
+ZIP_DTYPE = np.dtype([("zip", "<u4"), ("lat", "<f4"), ("lon", "<f4")])
+
+# The Census Bureau's ZCTA Gazetteer file the ZIP index is built from
+# (https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html)
+GAZETTEER_URL = "https://www2.census.gov/geo/docs/maps-data/data/gazetteer/2023_Gazetteer/2023_Gaz_zcta_national.zip"
+
+
+# (zip, lat, lon) rows from a tab separated Gazetteer file
+def read_gazetteer(f):
+    reader = csv.reader(f, delimiter="\t")
+    header = [column.strip() for column in next(reader)]
+    zip_col, lat_col, lon_col = header.index("GEOID"), header.index("INTPTLAT"), header.index("INTPTLONG")
+    for row in reader:
+        yield int(row[zip_col]), float(row[lat_col]), float(row[lon_col].strip())
+
+
+# Downloads the zipped Gazetteer file and writes the ZIP index to `path`. Returns the number of ZIP codes
+def download_zip_index(path, url=GAZETTEER_URL, timeout=60):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        data = response.read()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        name = next(name for name in archive.namelist() if name.endswith(".txt"))
+        with archive.open(name) as f:
+            return ZipIndex.build(read_gazetteer(io.TextIOWrapper(f, encoding="utf-8", newline="")), path)
+
+
+# Offline ZIP code -> (latitude, longitude) table, memory-mapped so it costs almost nothing to load
+class ZipIndex:
+    def __init__(self, table):
+        self.table = table
+        self._zips = table["zip"]
+
+    # A missing index is built from the Gazetteer at `url` first, e.g. on the first start after a deployment
+    @classmethod
+    def load(cls, path, url=None):
+        if path and not os.path.exists(path) and url:
+            try:
+                logger.info("Built the ZIP index with %d ZIP codes", download_zip_index(path, url))
+            except Exception:
+                logger.exception("Could not build the ZIP index from %s", url)
+        if not path or not os.path.exists(path):
+            logger.warning("ZIP index %s not found, postal lookups will use Earth911", path)
+            return cls(np.empty(0, dtype=ZIP_DTYPE))
+        return cls(np.load(path, mmap_mode="r"))
+
+    # Writes (zip, lat, lon) rows as a sorted .npy table
+    @staticmethod
+    def build(rows, path):
+        table = np.array(sorted(rows), dtype=ZIP_DTYPE)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.save(path, table)
+        return len(table)
+
+    def __len__(self):
+        return len(self.table)
+
+    def lookup(self, zip_code):
+        if len(zip_code) != 5 or not zip_code.isdigit():
+            return None
+        code = int(zip_code)
+        i = int(np.searchsorted(self._zips, code))
+        if i < len(self._zips) and self._zips[i] == code:
+            row = self.table[i]
+            return float(row["lat"]), float(row["lon"])
+        return None
+
+
+# Great-circle distance in miles
+def haversine_miles(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(1.0, a)))
+
+
+# Drop-off sites per material in a lat/lon grid, persisted in SQLite and built up from Earth911 responses.
+# Every search that was sent to Earth911 is kept as a covered region, so later queries inside it stay local
+class LocationIndex:
+    def __init__(self, path=None, cell_degrees=0.5, ttl=7 * 24 * 3600):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self._sites = defaultdict(dict)
+        self._grid = defaultdict(set)
+        self._regions = defaultdict(list)
+        self._lock = threading.Lock()
+        self._refresher = None
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Other server processes on the host share the file, so a busy database is waited on and readers aren't
+        # blocked while one of them writes
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, timeout=5)
+        if path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.create_function("haversine_miles", 4, haversine_miles, deterministic=True)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS sites (
+                    material_id TEXT NOT NULL,
+                    location_id TEXT NOT NULL,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    description TEXT,
+                    PRIMARY KEY (material_id, location_id)
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS regions (
+                    material_id TEXT NOT NULL,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    radius REAL NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+
+        for material_id, location_id, lat, lon, description in self._db.execute("SELECT * FROM sites"):
+            self._insert_site(material_id, {"location_id": location_id, "latitude": lat, "longitude": lon,
+                                            "description": description})
+        for material_id, lat, lon, radius, fetched_at in self._db.execute("SELECT * FROM regions"):
+            self._regions[material_id].append((lat, lon, radius, fetched_at))
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def _insert_site(self, material_id, site):
+        self._sites[material_id][site["location_id"]] = site
+        self._grid[(material_id, *self._cell(site["latitude"], site["longitude"]))].add(site["location_id"])
+
+    def _remove_site(self, material_id, location_id):
+        site = self._sites[material_id].pop(location_id)
+        self._grid[(material_id, *self._cell(site["latitude"], site["longitude"]))].discard(location_id)
+
+    # True if earlier searches answer a query for the `k` closest sites within `radius` of (lat, lon): either a
+    # searched region contains the whole circle, or the part of the circle inside one already holds `k` sites.
+    # The second case keeps dense areas, where capped responses shrink the regions, from always going to Earth911
+    def covers(self, material_id, lat, lon, radius, k=None):
+        material_id = str(material_id)
+        with self._lock:
+            inner = max((r_radius - haversine_miles(r_lat, r_lon, lat, lon)
+                         for r_lat, r_lon, r_radius, _ in self._regions[material_id]), default=-1.0)
+            if inner >= radius:
+                return True
+            # Every site within `inner` of the query is known, so k of them are the k closest overall
+            return k is not None and inner > 0 and len(self._within(material_id, lat, lon, inner)) >= k
+
+    # Records the sites from one searchLocations call. When the response hit `max_results`, only the circle out
+    # to the farthest returned site is known to be complete. Known sites inside that circle that the response
+    # no longer lists have closed or stopped taking the material, so they are dropped
+    def add(self, material_id, lat, lon, radius, sites, max_results=None):
+        material_id = str(material_id)
+        sites = [{"location_id": str(site["location_id"]), "latitude": float(site["latitude"]),
+                  "longitude": float(site["longitude"]), "description": site.get("description")} for site in sites]
+        if max_results is not None and len(sites) >= max_results:
+            radius = max(haversine_miles(lat, lon, site["latitude"], site["longitude"]) for site in sites)
+
+        with self._lock:
+            returned = {site["location_id"] for site in sites}
+            # Strictly inside, since a site tied with the farthest one of a capped response may just have been cut
+            gone = [site["location_id"] for distance, site in self._within(material_id, lat, lon, radius)
+                    if distance < radius and site["location_id"] not in returned]
+            for location_id in gone:
+                self._remove_site(material_id, location_id)
+
+            for site in sites:
+                if site["location_id"] in self._sites[material_id]:
+                    self._remove_site(material_id, site["location_id"])
+                self._insert_site(material_id, site)
+
+            # A fresh search replaces the regions it contains
+            now = time.time()
+            self._regions[material_id] = [
+                region for region in self._regions[material_id]
+                if haversine_miles(region[0], region[1], lat, lon) + region[2] > radius
+            ] + [(lat, lon, radius, now)]
+
+            with self._db:
+                self._db.executemany("DELETE FROM sites WHERE material_id = ? AND location_id = ?",
+                                     [(material_id, location_id) for location_id in gone])
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?, ?)",
+                    [(material_id, s["location_id"], s["latitude"], s["longitude"], s["description"]) for s in sites]
+                )
+                # Only the rows this search replaces, so regions other processes wrote are kept
+                self._db.execute("""
+                    DELETE FROM regions
+                    WHERE material_id = ? AND haversine_miles(latitude, longitude, ?, ?) + radius <= ?
+                """, (material_id, lat, lon, radius))
+                self._db.execute("INSERT INTO regions VALUES (?, ?, ?, ?, ?)", (material_id, lat, lon, radius, now))
+
+    # (distance, site) for every known site within `radius` miles, unsorted. The caller holds the lock
+    def _within(self, material_id, lat, lon, radius):
+        lat_span = radius / 69.0
+        lon_span = radius / max(1e-6, 69.0 * math.cos(math.radians(lat)))
+        min_x, min_y = self._cell(lat - lat_span, lon - lon_span)
+        max_x, max_y = self._cell(lat + lat_span, lon + lon_span)
+
+        found = []
+        sites = self._sites[material_id]
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for location_id in self._grid.get((material_id, x, y), ()):
+                    site = sites[location_id]
+                    distance = haversine_miles(lat, lon, site["latitude"], site["longitude"])
+                    if distance <= radius:
+                        found.append((distance, site))
+        return found
+
+    # The `k` closest sites within `radius` miles, nearest first, with their distance filled in
+    def nearest(self, material_id, lat, lon, k, radius):
+        with self._lock:
+            found = self._within(str(material_id), lat, lon, radius)
+        found.sort(key=lambda item: item[0])
+        return [{**site, "distance": distance} for distance, site in found[:k]]
+
+    def stale_regions(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            return [(material_id, lat, lon, radius)
+                    for material_id, regions in self._regions.items()
+                    for lat, lon, radius, fetched_at in regions if fetched_at < cutoff]
+
+    # Re-runs stale searches every `interval` seconds on a daemon thread. `search(lat, lon, material_id, radius)`
+    # returns (sites, max_results) like a live searchLocations call
+    def start_refresher(self, search, interval=3600):
+        if self._refresher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                for material_id, lat, lon, radius in self.stale_regions():
+                    try:
+                        sites, max_results = search(lat, lon, material_id, radius)
+                        self.add(material_id, lat, lon, radius, sites, max_results)
+                    except Exception:
+                        logger.exception("Could not refresh drop-off locations for material %s", material_id)
+
+        self._refresher = threading.Thread(target=run, name="location-index-refresher", daemon=True)
+        self._refresher.start()
+
+    def __len__(self):
+        return sum(len(sites) for sites in self._sites.values())
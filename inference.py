@@ -0,0 +1,485 @@
+import os
+import json
+import glob
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+import queue
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMG_SIZE = 224
+
+class_names = [
+    "Battery",
+    "Biological",
+    "Brown-glass",
+    "Cardboard",
+    "Clothes",
+    "Green-glass",
+    "Metal",
+    "Paper",
+    "Plastic",
+    "Shoes",
+    "Trash",
+    "White-glass"
+]
+
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+MAX_IMAGE_PIXELS = 40_000_000
+
+UNREADABLE_IMAGE = "Could not read the image. Please upload a valid JPG or PNG."
+
+# Reduction factors libjpeg can apply in the DCT domain while decoding, largest first
+REDUCED_DECODE_FACTORS = (8, 4, 2)
+
+
+# Raised for uploads that are too large or can't be read as an image
+class ImageRejectedError(ValueError):
+    pass
+
+
+# Reads the width and height from the JPEG/PNG header without decoding any pixels
+def image_dimensions(data):
+    data = memoryview(data).cast("B")
+
+    if len(data) >= 24 and bytes(data[:8]) == b"\x89PNG\r\n\x1a\n":
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        # Padding and markers without a length field
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        # Start-of-frame markers (skipping DHT, JPG and DAC, which share the range)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return (data[i + 7] << 8) | data[i + 8], (data[i + 5] << 8) | data[i + 6]
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+# Decodes an upload straight from its buffer into a model-ready 224x224 RGB image
+def preprocess(buffer, dtype=np.float32, max_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    # Imported here so OpenCV loads with the model warm-up instead of delaying the first page render
+    import cv2
+
+    # Zero-copy view over the upload, no bytearray or extra NumPy copy
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size > max_bytes:
+        raise ImageRejectedError(f"Image is too large. Please upload a file under {max_bytes // (1024 * 1024)} MB.")
+
+    # Without a readable header the resolution can't be checked, so the file is never handed to the decoder
+    dimensions = image_dimensions(data)
+    if dimensions is None:
+        raise ImageRejectedError(UNREADABLE_IMAGE)
+    width, height = dimensions
+    if width * height > max_pixels:
+        raise ImageRejectedError("Image resolution is too high. Please upload a smaller picture.")
+
+    flag = cv2.IMREAD_COLOR
+    # Largest reduction that still leaves at least 224 pixels on each side
+    for factor in REDUCED_DECODE_FACTORS:
+        if min(width, height) // factor >= IMG_SIZE:
+            flag = getattr(cv2, f"IMREAD_REDUCED_COLOR_{factor}")
+            break
+
+    img = cv2.imdecode(data, flag)
+    if img is None:
+        raise ImageRejectedError(UNREADABLE_IMAGE)
+
+    # Resizing before the color swap means the conversion only touches 224x224 pixels
+    img = cv2.resize(img, (IMG_SIZE, IMG_SIZE), interpolation=cv2.INTER_AREA)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    if dtype == np.uint8:
+        return img
+    return np.multiply(img, np.float32(1 / 255), dtype=np.float32)
+
+
+# Full-precision Keras model, the same one that is published on the Hub
+# Calls the model through a tf.function traced once for a fixed (None, 224, 224, 3) float32 signature,
+# skipping the data adapter, progress bar and callbacks that model.predict sets up on every call
+class KerasBackend:
+    name = "keras"
+    input_dtype = np.float32
+
+    def __init__(self, model, jit_compile=False):
+        import tensorflow as tf
+
+        self.model = model
+        self.jit_compile = jit_compile
+        self._infer = tf.function(
+            lambda batch: model(batch, training=False),
+            input_signature=[tf.TensorSpec((None, IMG_SIZE, IMG_SIZE, 3), tf.float32)],
+            jit_compile=jit_compile
+        )
+        # Traces (and with XLA compiles) before the first real request
+        self._infer(np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32))
+
+    # Takes a batch of RGB images scaled to [0, 1] and returns the class probabilities
+    def predict(self, batch):
+        count = len(batch)
+        # XLA compiles once per batch size, so batches are padded up to a power of two to bound recompiles
+        if self.jit_compile:
+            padded = 1 << (count - 1).bit_length()
+            if padded != count:
+                batch = np.concatenate([batch, np.zeros((padded - count, *batch.shape[1:]), dtype=batch.dtype)])
+        return self._infer(batch).numpy()[:count]
+
+
+# int8-quantized TFLite copy of the Keras model for CPU-only nodes
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, tflite_path, num_threads=None):
+        import tensorflow as tf
+
+        self.interpreter = tf.lite.Interpreter(model_path=tflite_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self._batch_size = self.input["shape"][0]
+        # A uint8 input quantized with scale 1/255 takes raw pixels, so preprocessing can skip the float pass
+        scale, zero_point = self.input["quantization"]
+        raw_pixels = self.input["dtype"] == np.uint8 and zero_point == 0 and abs(scale * 255 - 1) < 1e-3
+        self.input_dtype = np.uint8 if raw_pixels else np.float32
+        # The interpreter holds its tensors in place, so only one batch can run at a time
+        self._lock = threading.Lock()
+
+    def _quantize(self, batch):
+        scale, zero_point = self.input["quantization"]
+        dtype = self.input["dtype"]
+        if batch.dtype == dtype and self.input_dtype == dtype:
+            return batch
+        if batch.dtype == np.uint8:
+            batch = batch.astype(np.float32) / 255.0
+        if not scale:
+            return batch.astype(dtype)
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def predict(self, batch):
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+
+            self.interpreter.set_tensor(self.input["index"], self._quantize(batch))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output["index"]).copy()
+
+        scale, zero_point = self.output["quantization"]
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+# Loads up to `count` real photos for calibration and parity checks, or None if there are none. Random noise
+# would calibrate and pass the parity gate without saying anything about accuracy on photos
+def calibration_images(calibration_dir=None, count=200):
+    images = []
+    if calibration_dir:
+        paths = sorted(glob.glob(os.path.join(calibration_dir, "**", "*.jp*g"), recursive=True))
+        for path in paths[:count]:
+            try:
+                images.append(preprocess(np.fromfile(path, dtype=np.uint8)))
+            except ImageRejectedError:
+                continue
+    return np.stack(images) if images else None
+
+
+# Shuffles the photos into a calibration set and a held-out set, so parity is measured on images the
+# quantization never saw
+def split_calibration(images, holdout=0.3, seed=0):
+    order = np.random.default_rng(seed).permutation(len(images))
+    held_out = max(1, int(len(images) * holdout))
+    return images[order[held_out:]], images[order[:held_out]]
+
+
+# Converts the Keras model with post-training int8 quantization and writes it atomically
+def convert_to_tflite(model, tflite_path, representative_images):
+    import tensorflow as tf
+
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        model.export(saved_model_dir, format="tf_saved_model", verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+
+        def representative_dataset():
+            for img in representative_images:
+                yield [img[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        tflite_model = converter.convert()
+
+    tmp_path = tflite_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, tflite_path)
+
+
+# Fraction of images where both backends pick the same class
+def top1_agreement(reference, candidate, images, batch_size=16):
+    matches = 0
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        matches += int(np.sum(np.argmax(reference.predict(batch), axis=1) == np.argmax(candidate.predict(batch), axis=1)))
+    return matches / len(images)
+
+
+# Picks the inference engine by name. The Keras model is only loaded when it is actually needed. TFLite is
+# only used once the int8 engine agrees with Keras on at least `min_parity_samples` held-out real photos
+def load_backend(name, model_path, load_keras_model, calibration_dir=None, min_agreement=0.95, num_threads=None,
+                 jit_compile=False, min_parity_samples=20):
+    if name == "keras":
+        return KerasBackend(load_keras_model(), jit_compile=jit_compile)
+    if name != "tflite":
+        raise ValueError(f"Unknown inference backend: {name}")
+
+    # Cached next to the Hub artifact, so a new model revision gets its own conversion
+    tflite_path = os.path.splitext(model_path)[0] + "_int8.tflite"
+    parity_path = tflite_path + ".json"
+
+    parity = None
+    if os.path.exists(tflite_path) and os.path.exists(parity_path):
+        with open(parity_path) as f:
+            parity = json.load(f)
+        # Conversions checked on synthetic images or on their own calibration set are redone
+        if not parity.get("held_out"):
+            parity = None
+
+    model = None
+    if parity is None:
+        images = calibration_images(calibration_dir)
+        if images is None or len(split_calibration(images)[1]) < min_parity_samples:
+            logger.warning("TFLite needs enough real photos in the calibration folder for %d held-out parity "
+                           "checks (found %d), using Keras", min_parity_samples, 0 if images is None else len(images))
+            return KerasBackend(load_keras_model(), jit_compile=jit_compile)
+
+        model = load_keras_model()
+        calibration, held_out = split_calibration(images)
+        convert_to_tflite(model, tflite_path, calibration)
+        agreement = top1_agreement(KerasBackend(model), TFLiteBackend(tflite_path), held_out)
+        parity = {"agreement": agreement, "samples": len(held_out), "calibration_samples": len(calibration),
+                  "calibration": calibration_dir, "held_out": True}
+        with open(parity_path, "w") as f:
+            json.dump(parity, f)
+
+    logger.info("TFLite top-1 agreement with Keras: %.3f over %d held-out images from %s",
+                parity["agreement"], parity["samples"], parity["calibration"])
+
+    if parity["agreement"] < min_agreement or parity["samples"] < min_parity_samples:
+        logger.warning("TFLite agreement %.3f over %d images is below %.3f over %d, falling back to Keras",
+                       parity["agreement"], parity["samples"], min_agreement, min_parity_samples)
+        return KerasBackend(model if model is not None else load_keras_model(), jit_compile=jit_compile)
+
+    return TFLiteBackend(tflite_path, num_threads=num_threads)
+
+
+# Collects single-image requests from concurrent sessions and runs them through the model as one batch.
+# With `workers` > 1 several batches can be in flight at once, for backends that run them in parallel
+class BatchScheduler:
+    def __init__(self, predict_batch, max_batch_size=16, max_wait_ms=10, workers=1):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for i in range(max(1, workers)):
+            threading.Thread(target=self._run, name=f"batch-scheduler-{i}", daemon=True).start()
+
+    # Queues one preprocessed image and blocks until its row of the batched prediction is ready
+    def submit(self, img):
+        future = Future()
+        self._queue.put((img, future))
+        return future.result()
+
+    # Waits for the first request, then keeps collecting until the batch is full or the window closes
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+            try:
+                predictions = self.predict_batch(np.stack([img for img, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+
+# Identifies the loaded model by the artifact's content and the engine running it
+def model_version(model_path, backend_name):
+    hasher = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return f"{hasher.hexdigest()[:16]}-{backend_name}"
+
+
+# Bounded LRU of (class_name, confidence) keyed by image hash, with an optional SQLite tier that survives restarts
+class PredictionCache:
+    def __init__(self, model_version, max_entries=1024, path=None, max_rows=100_000, purge_every=500):
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.purge_every = purge_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                self._db.execute("""
+                    CREATE TABLE IF NOT EXISTS predictions (
+                        image_hash TEXT NOT NULL,
+                        model_version TEXT NOT NULL,
+                        class_name TEXT NOT NULL,
+                        confidence REAL NOT NULL,
+                        PRIMARY KEY (image_hash, model_version)
+                    )
+                """)
+                # Results from any other model artifact are stale
+                self._db.execute("DELETE FROM predictions WHERE model_version != ?", (model_version,))
+
+    def _remember(self, image_hash, result):
+        self._entries[image_hash] = result
+        self._entries.move_to_end(image_hash)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, image_hash):
+        with self._lock:
+            result = self._entries.get(image_hash)
+            if result is not None:
+                self._entries.move_to_end(image_hash)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT class_name, confidence FROM predictions WHERE image_hash = ? AND model_version = ?",
+                    (image_hash, self.model_version)
+                ).fetchone()
+                if row is not None:
+                    result = row[0], row[1]
+                    self._remember(image_hash, result)
+
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def put(self, image_hash, result):
+        with self._lock:
+            self._remember(image_hash, result)
+            self._writes += 1
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                        (image_hash, self.model_version, result[0], result[1])
+                    )
+                    # A replaced row gets a new rowid, so the lowest rowids are the oldest predictions
+                    if self._writes % self.purge_every == 0:
+                        self._db.execute("""
+                            DELETE FROM predictions WHERE rowid IN (
+                                SELECT rowid FROM predictions ORDER BY rowid DESC LIMIT -1 OFFSET ?
+                            )
+                        """, (self.max_rows,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries)
+        }
+
+
+# Classifies many images with bounded memory: `workers` threads decode at most `2 * batch_size` images ahead
+# of inference, which runs in batches. `sources` yields (name, read) pairs where read() returns the file's bytes.
+# Yields (name, class_name, confidence, error) in input order
+def classify_many(sources, backend, batch_size=32, workers=4, **preprocess_options):
+    def load(source):
+        name, read = source
+        try:
+            return name, preprocess(read(), dtype=backend.input_dtype, **preprocess_options), None
+        except (ImageRejectedError, OSError) as e:
+            return name, None, str(e)
+
+    def run(batch):
+        predictions = backend.predict(np.stack([img for _, img in batch]))
+        for (name, _), prediction in zip(batch, predictions):
+            index = int(np.argmax(prediction))
+            yield name, class_names[index], float(prediction[index]) * 100, None
+
+    sources = iter(sources)
+    pending = deque()
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-decode") as pool:
+        while True:
+            while len(pending) < 2 * batch_size:
+                source = next(sources, None)
+                if source is None:
+                    break
+                pending.append(pool.submit(load, source))
+            if not pending:
+                break
+
+            name, img, error = pending.popleft().result()
+            if error is not None:
+                yield from run(batch) if batch else ()
+                batch = []
+                yield name, None, None, error
+                continue
+
+            batch.append((name, img))
+            if len(batch) == batch_size:
+                yield from run(batch)
+                batch = []
+
+    if batch:
+        yield from run(batch)
@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the prompt changes so stored responses for the old prompt are ignored
+PROMPT_VERSION = 1
+
+CONFIDENCE_THRESHOLD = 90
+
+
+# The only two things the prompt depends on besides the class
+def confidence_band(confidence):
+    return "high" if confidence >= CONFIDENCE_THRESHOLD else "low"
+
+
+def build_prompt(prediction, band):
+    confidence = f"{CONFIDENCE_THRESHOLD}% or higher" if band == "high" else f"below {CONFIDENCE_THRESHOLD}%"
+    return f"""
+    You are a smart waste disposal assistant that helps users with their trash. You are going to get a prediction
+    from a CNN Model on what the object is and you have to analyze the following object and provide a clear, friendly response that includes:
+
+    The classification: **Is this recyclable, compostable, or trash?** (Say only one — don't mention what it is *not*)
+    Briefly explain why it fits in that category only if it is not trash. Focus only on why it belongs in that category — do not explain why it isn’t in the others.
+    A fun fact about the item (add an emoji if appropriate)
+    If confidence is below 90%, let the user know that the the classification may be inaccurate
+    A reminder: 📍 *To find where to dispose of this item, go to the Locations tab.*
+
+    If the object name is too broad, generalize it to the most common example:
+    - **Metal:** aluminum cans, steel cans
+    - **Biological:** food scraps, leaves, fruits, rotten vegetables, moldy bread
+    - **Trash:** dirty diapers, face masks, toothbrushes
+
+    Do not tell the user to check with their local recycling center — that warning has already been provided.
+
+    **Use first person POV for user engagement even if you are talking about the CNN Model**
+
+    Here is the object: **{prediction}**
+    Here is the confidence score: **{confidence}**
+    """
+
+
+# Where each class goes, for replies written without Gemini
+DISPOSAL = {
+    "Battery": ("hazardous waste", "Batteries can leak or start fires, so take them to a battery drop-off"),
+    "Biological": ("compost", "Food scraps and yard waste break down into compost instead of rotting in a landfill"),
+    "Brown-glass": ("recycling", "Glass can be melted down and made into new bottles again and again"),
+    "Cardboard": ("recycling", "Clean, dry cardboard is pulped and turned into new boxes"),
+    "Clothes": ("donation or textile recycling", "Wearable clothes can be donated and worn-out ones turned into rags"),
+    "Green-glass": ("recycling", "Glass can be melted down and made into new bottles again and again"),
+    "Metal": ("recycling", "Aluminum and steel cans can be recycled endlessly without losing quality"),
+    "Paper": ("recycling", "Clean paper is pulped and made into new paper products"),
+    "Plastic": ("recycling", "Rinsed plastic containers marked #1 or #2 are accepted by most curbside bins"),
+    "Shoes": ("donation or shoe recycling", "Usable shoes can be donated and worn-out ones go to take-back programs"),
+    "Trash": ("trash", None),
+    "White-glass": ("recycling", "Glass can be melted down and made into new bottles again and again")
+}
+
+
+# A reply built locally from the class, a tip and the confidence, shown when Gemini is busy or too slow
+def fallback_response(prediction, confidence, tip=None):
+    category, reason = DISPOSAL.get(prediction, ("trash", None))
+    lines = [f"I think this is **{prediction}**, so it belongs in **{category}**."]
+    if reason:
+        lines.append(reason + ".")
+    if tip:
+        lines.append(tip)
+    if confidence < CONFIDENCE_THRESHOLD:
+        lines.append(f"I'm only {confidence:.0f}% sure about this one, so the classification may be inaccurate.")
+    lines.append("📍 *To find where to dispose of this item, go to the Locations tab.*")
+    return "\n\n".join(lines)
+
+
+# Closes a live reply that was cut off after it started, so it doesn't just stop mid-sentence
+def interrupted_notice(prediction):
+    category, _ = DISPOSAL.get(prediction, ("trash", None))
+    return (f"…\n\n*The rest of this reply took too long and was cut short.* In short, **{prediction}** belongs in "
+            f"**{category}**.")
+
+
+class LLMOverloaded(Exception):
+    pass
+
+
+class LLMTimeout(Exception):
+    pass
+
+
+# Process-wide admission control for Gemini: at most `max_concurrent` calls in flight and at most `rate_per_minute`
+# started per minute. Up to `max_waiting` callers queue for `max_wait` seconds, anyone beyond that is shed at once
+# instead of piling up behind the quota
+class AdmissionController:
+    def __init__(self, max_concurrent=4, rate_per_minute=None, max_waiting=8, max_wait=2.0):
+        self.max_concurrent = max_concurrent
+        self.rate_per_minute = rate_per_minute
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.admitted = 0
+        self.rejected = 0
+        self._in_flight = 0
+        self._waiting = 0
+        self._tokens = float(max_concurrent)
+        self._refilled = time.monotonic()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    # Token bucket that refills at the per-minute rate and bursts up to max_concurrent calls
+    def _take_token(self):
+        if not self.rate_per_minute:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.max_concurrent, self._tokens + (now - self._refilled) * self.rate_per_minute / 60)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    # Takes a slot, waiting up to `timeout` seconds (max_wait by default). Raises LLMOverloaded if none frees up
+    def acquire(self, timeout=None):
+        deadline = time.monotonic() + (self.max_wait if timeout is None else timeout)
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                self.rejected += 1
+                raise LLMOverloaded("Too many Gemini calls waiting")
+            self._waiting += 1
+        try:
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise LLMOverloaded("No Gemini slot freed up in time")
+            while True:
+                with self._lock:
+                    if self._take_token():
+                        self._in_flight += 1
+                        self.admitted += 1
+                        return
+                if time.monotonic() >= deadline:
+                    self._slots.release()
+                    raise LLMOverloaded("Gemini rate limit reached")
+                time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+        except LLMOverloaded:
+            with self._lock:
+                self.rejected += 1
+            raise
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    @contextmanager
+    def slot(self, timeout=None):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected
+            }
+
+
+# Keeps several Gemini replies per (class, confidence band, prompt version) so the LLM is only called on a miss
+class ResponseStore:
+    def __init__(self, generate, generate_stream=None, path=None, variants=3, ttl=7 * 24 * 3600, min_interval=2.0,
+                 limiter=None, deadline=None):
+        self._generate = generate
+        self._generate_stream = generate_stream or (lambda prompt: iter([generate(prompt)]))
+        self.path = path
+        self.variants = variants
+        self.ttl = ttl
+        # Spaces out background calls so warming doesn't eat the Gemini rate limit
+        self.min_interval = min_interval
+        self.limiter = limiter
+        # Seconds a live reply may take in total, from the call to its last chunk
+        self.deadline = deadline
+        self.hits = 0
+        self.misses = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self.interrupted = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                logger.warning("Could not read the response store at %s, starting empty", path)
+
+    @staticmethod
+    def key(prediction, band):
+        return f"{prediction}|{band}|v{PROMPT_VERSION}"
+
+    def _fresh(self, variants):
+        now = time.time()
+        return [v for v in variants if now - v["created"] < self.ttl]
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    # Stores a new reply, dropping expired ones and keeping at most `variants` per key
+    def add(self, prediction, band, text):
+        key = self.key(prediction, band)
+        with self._lock:
+            variants = self._fresh(self._entries.get(key, []))
+            variants.append({"text": text, "created": time.time()})
+            self._entries[key] = variants[-self.variants:]
+            self._save()
+
+    # Picks a random stored reply. Expired ones are still served until the refresher replaces them
+    def get(self, prediction, band):
+        with self._lock:
+            variants = self._entries.get(self.key(prediction, band))
+            if variants:
+                self.hits += 1
+                return random.choice(variants)["text"]
+            self.misses += 1
+            return None
+
+    # Gemini's chunks, read on a helper thread so a stalled call is abandoned after `deadline` seconds. The
+    # limiter slot is held until the call itself finishes, so abandoned calls still count against the quota
+    def _live_stream(self, prompt):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        if self.deadline is None:
+            try:
+                yield from self._generate_stream(prompt)
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release()
+            return
+
+        chunks = queue.Queue()
+
+        def produce():
+            try:
+                for chunk in self._generate_stream(prompt):
+                    chunks.put((True, chunk))
+                chunks.put((True, None))
+            except Exception as e:
+                chunks.put((False, e))
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release()
+
+        threading.Thread(target=produce, name="gemini-stream", daemon=True).start()
+        deadline = time.monotonic() + self.deadline
+        while True:
+            try:
+                ok, chunk = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise LLMTimeout(f"Gemini took longer than {self.deadline}s") from None
+            if not ok:
+                raise chunk
+            if chunk is None:
+                return
+            yield chunk
+
+    # Yields a stored reply in one piece, or Gemini's chunks as they arrive on a miss. When Gemini is saturated,
+    # slow or failing, `fallback` is shown instead and nothing is stored
+    def stream(self, prediction, band, fallback=None):
+        text = self.get(prediction, band)
+        if text is not None:
+            yield text
+            return
+
+        chunks = []
+        try:
+            for chunk in self._live_stream(build_prompt(prediction, band)):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            with self._lock:
+                if isinstance(e, LLMOverloaded):
+                    self.shed += 1
+                elif isinstance(e, LLMTimeout):
+                    self.timeouts += 1
+                else:
+                    self.errors += 1
+            if fallback is None:
+                raise
+            logger.warning("Gemini reply for %s failed: %s", prediction, e)
+            # A reply that already started is closed with a short notice rather than followed by a second one
+            with self._lock:
+                if chunks:
+                    self.interrupted += 1
+                else:
+                    self.fallbacks += 1
+            yield interrupted_notice(prediction) if chunks else fallback
+            return
+        self.add(prediction, band, "".join(chunks))
+
+    # Fills every key up to `variants` fresh replies
+    def warm(self, class_names):
+        for prediction in class_names:
+            for band in ("high", "low"):
+                key = self.key(prediction, band)
+                with self._lock:
+                    missing = self.variants - len(self._fresh(self._entries.get(key, [])))
+                for _ in range(missing):
+                    try:
+                        # Background calls never wait for a slot, they just try again next round
+                        if self.limiter is not None:
+                            with self.limiter.slot(timeout=0):
+                                text = self._generate(build_prompt(prediction, band))
+                        else:
+                            text = self._generate(build_prompt(prediction, band))
+                        self.add(prediction, band, text)
+                    except LLMOverloaded:
+                        logger.info("Gemini is busy, postponing the warm-up of %s", key)
+                        return
+                    except Exception:
+                        logger.exception("Could not warm the Gemini response for %s", key)
+                        break
+                    time.sleep(self.min_interval)
+
+    # Warms the store now and again every `interval` seconds on a daemon thread
+    def start_refresher(self, class_names, interval=3600):
+        if self._refresher is not None:
+            return
+
+        def run():
+            while True:
+                self.warm(class_names)
+                time.sleep(interval)
+
+        self._refresher = threading.Thread(target=run, name="response-store-refresher", daemon=True)
+        self._refresher.start()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "keys": len(self._entries),
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+            "interrupted": self.interrupted
+        }
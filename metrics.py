@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("greenbin.trace")
+
+# Upper bounds in seconds, from a cache hit to a slow Gemini reply
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+# Cumulative bucket counts for Prometheus, plus a window of recent observations for percentiles
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1000):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+
+    def percentile(self, q):
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else None
+
+
+# In-process stage timings and counters. Components that keep their own stats() are registered as collectors
+# and reported as gauges
+class Metrics:
+    def __init__(self, namespace="greenbin", trace=False):
+        self.namespace = namespace
+        self.trace = trace
+        if trace and not trace_logger.handlers:
+            trace_logger.addHandler(logging.StreamHandler())
+            trace_logger.setLevel(logging.INFO)
+        self._histograms = defaultdict(Histogram)
+        self._counters = defaultdict(int)
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def observe(self, name, seconds, **labels):
+        with self._lock:
+            self._histograms[(name, _labels(labels))].observe(seconds)
+
+    def count(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[(name, _labels(labels))] += amount
+
+    def register(self, name, stats):
+        self._collectors[name] = stats
+
+    # Times the block into the `name` histogram. Failed spans are also counted under `<name>_errors`
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+            if error is not None:
+                self.count(f"{name}_errors", **labels)
+            if self.trace:
+                trace_logger.info(json.dumps({"request_id": current_request_id(), "span": name, **labels,
+                                              "ms": round(seconds * 1000, 2), "error": error}))
+
+    # Tags every span inside the block with one request ID and times the whole request
+    @contextmanager
+    def request(self, name, request_id=None):
+        token = _request_id.set(request_id or uuid.uuid4().hex[:12])
+        try:
+            with self.span(f"{name}_request"):
+                yield _request_id.get()
+        finally:
+            _request_id.reset(token)
+
+    # Returns fn wrapped in a span, for methods of objects created elsewhere
+    def timed(self, name, fn, **labels):
+        def wrapper(*args, **kwargs):
+            with self.span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    # Per stage: count, mean and recent p50/p95/p99 in milliseconds
+    def summary(self):
+        with self._lock:
+            rows = []
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                rows.append({
+                    "stage": name + _format_labels(labels),
+                    "count": histogram.count,
+                    "mean_ms": histogram.sum / histogram.count * 1000,
+                    "p50_ms": histogram.percentile(0.50) * 1000,
+                    "p95_ms": histogram.percentile(0.95) * 1000,
+                    "p99_ms": histogram.percentile(0.99) * 1000
+                })
+            return rows
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, _labels(labels)), 0)
+
+    def counters(self):
+        with self._lock:
+            return {name + _format_labels(labels): value for (name, labels), value in sorted(self._counters.items())}
+
+    # Numeric values from every collector, nested dicts flattened into one name
+    def gauges(self):
+        gauges = {}
+
+        def flatten(prefix, value):
+            if isinstance(value, bool):
+                gauges[prefix] = int(value)
+            elif isinstance(value, (int, float)):
+                gauges[prefix] = value
+            elif isinstance(value, dict):
+                for key, item in value.items():
+                    flatten(f"{prefix}_{key}", item)
+
+        for name, stats in list(self._collectors.items()):
+            try:
+                flatten(name, stats())
+            except Exception:
+                logger.exception("Could not collect the %s metrics", name)
+        return gauges
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        typed = set()
+
+        def declare(metric, kind):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = f"{self.namespace}_{_metric_name(name)}_seconds"
+                declare(metric, "histogram")
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = f"{self.namespace}_{_metric_name(name)}_total"
+                declare(metric, "counter")
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+        for name, value in sorted(self.gauges().items()):
+            metric = f"{self.namespace}_{_metric_name(name)}"
+            declare(metric, "gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        # Atomic so a scraper reading the file never sees half of it
+        os.replace(tmp_path, path)
+
+    # Rewrites the file every `interval` seconds, for node_exporter's textfile collector
+    def start_writer(self, path, interval=15):
+        def run():
+            while True:
+                try:
+                    self.write(path)
+                except OSError:
+                    logger.exception("Could not write metrics to %s", path)
+                time.sleep(interval)
+
+        threading.Thread(target=run, name="metrics-writer", daemon=True).start()
+
+    # Serves /metrics on its own port, since Streamlit can't add routes to its server. Only on localhost unless
+    # `host` says otherwise, since the metrics carry request IDs and internal timings
+    def start_server(self, port, host="127.0.0.1"):
+        if self._server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
@@ -0,0 +1,187 @@
+import random
+import hashlib
+import contextvars
+from concurrent.futures import TimeoutError, as_completed
+
+import numpy as np
+import requests
+
+from content import tips
+from inference import MAX_IMAGE_PIXELS, MAX_UPLOAD_BYTES, class_names, preprocess
+from llm import confidence_band, fallback_response
+
+# The request path shared by app.py and tools/benchmark.py. Nothing in here knows about Streamlit: the app
+# wraps these calls with its widgets and error messages, the benchmark times them against local fakes
+
+
+# Generate a unique hash based on the bytes
+def get_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Image -> (class name, confidence). Identical images skip decoding and inference entirely
+class Predictor:
+    def __init__(self, backend, scheduler, cache, metrics, max_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.cache = cache
+        self.metrics = metrics
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+
+    def predict(self, buffer):
+        image_hash = get_hash(buffer)
+        cached = self.cache.get(image_hash)
+        if cached is not None:
+            return cached
+
+        with self.metrics.span("decode"):
+            img = preprocess(buffer, dtype=self.backend.input_dtype, max_bytes=self.max_bytes,
+                             max_pixels=self.max_pixels)
+
+        with self.metrics.span("inference"):
+            prediction = self.scheduler.submit(img)
+        index = int(np.argmax(prediction))
+        result = class_names[index], float(prediction[index]) * 100
+        self.cache.put(image_hash, result)
+        return result
+
+
+# The Gemini reply, streamed live only on a cache miss. A templated reply is used instead when Gemini is
+# saturated or too slow
+def generate_response(responses, prediction, confidence):
+    fallback = fallback_response(prediction, confidence, random.choice(tips.get(prediction)))
+    return responses.stream(prediction, confidence_band(confidence), fallback=fallback)
+
+
+# Queues the image for upload unless the manifest already knows it. Returns False for known duplicates
+def submit_contribution(image_store, upload_queue, metrics, image_bytes, true_class, mime_type):
+    # Known duplicates are caught right away, everything else is checked against the manifest by the workers
+    with metrics.span("upload_submit"):
+        if image_store.is_known(get_hash(image_bytes)):
+            return False
+        upload_queue.submit(image_bytes, true_class, mime_type)
+        return True
+
+
+# Earth911 lookups behind the local ZIP, material and location indexes and the shared response cache.
+# Lookups that can still return something useful pass their Earth911 errors to `on_error` instead of raising
+class Locator:
+    def __init__(self, earth911, cache, zip_index, materials, locations, pool, metrics, on_error=None,
+                 search_radius=50, search_max_results=50, bulk_details=False):
+        self.earth911 = earth911
+        self.cache = cache
+        self.zip_index = zip_index
+        self.materials = materials
+        self.locations = locations
+        self.pool = pool
+        self.metrics = metrics
+        self.on_error = on_error or (lambda e: None)
+        self.search_radius = search_radius
+        self.search_max_results = search_max_results
+        self.bulk_details = bulk_details
+
+    # (latitude, longitude) for the ZIP code, or None if it doesn't exist. The Census index has no PO box or
+    # single-organization ZIP codes, so codes it doesn't list are looked up on Earth911 and cached
+    def postal_coordinates(self, zip_code):
+        with self.metrics.span("geocode"):
+            coordinates = self.zip_index.lookup(zip_code)
+            self.metrics.count("zip_index_lookups", hit=coordinates is not None)
+            if coordinates is not None:
+                return coordinates
+            return self.cache.get_or_load("getPostalData", zip_code, lambda: self._fetch_postal_coordinates(zip_code))
+
+    def _fetch_postal_coordinates(self, zip_code):
+        result = self.earth911.get("getPostalData", country="US", postal_code=zip_code).get("result")
+        if result and "latitude" in result and "longitude" in result:
+            return result["latitude"], result["longitude"]
+        return None
+
+    # Earth911 material ID for the item, only searching Earth911 live for names the table doesn't know yet
+    def material_id(self, specific_item):
+        with self.metrics.span("material_lookup"):
+            return self.materials.get(specific_item)
+
+    # Searches are always wide so that changing the radius or result count can be answered locally. Also
+    # the search the location index's refresher uses
+    def search(self, lat, lon, material_id, radius):
+        result = self.earth911.get(
+            "searchLocations",
+            latitude=lat,
+            longitude=lon,
+            material_id=material_id,
+            max_distance=max(radius, self.search_radius),
+            max_results=self.search_max_results
+        ).get("result", [])
+        return result, self.search_max_results
+
+    # Nearest drop-off centers from the local index, only calling Earth911 for areas it hasn't covered yet
+    def dropoff_locations(self, lat, lon, material_id, max_distance=20, max_results=5):
+        covered = self.locations.covers(material_id, lat, lon, max_distance, max_results)
+        self.metrics.count("location_index_lookups", hit=covered)
+        if not covered:
+            radius = max(max_distance, self.search_radius)
+            try:
+                with self.metrics.span("location_search"):
+                    result, search_limit = self.search(lat, lon, material_id, radius)
+                self.locations.add(material_id, lat, lon, radius, result, search_limit)
+            except requests.exceptions.RequestException as e:
+                self.on_error(e)
+        return self.locations.nearest(material_id, lat, lon, max_results, max_distance)
+
+    # One location's details, cached per location
+    def location_details(self, location_id):
+        return self.cache.get_or_load(
+            "getLocationDetails", location_id,
+            lambda: self.earth911.get("getLocationDetails", location_id=location_id)["result"].get(location_id)
+        )
+
+    # Earth911 accepts several location IDs in one getLocationDetails call, so only the uncached ones are requested
+    def bulk_location_details(self, ids):
+        found = self.cache.get_many("getLocationDetails", ids)
+        missing = [location_id for location_id in ids if location_id not in found]
+        if missing:
+            try:
+                result = self.earth911.get("getLocationDetails", **{"location_id[]": missing})["result"]
+            except requests.exceptions.RequestException as e:
+                self.on_error(e)
+                return found
+            for location_id in missing:
+                found[location_id] = result.get(location_id)
+                self.cache.put("getLocationDetails", location_id, found[location_id])
+        return found
+
+    # Yields each location's details as soon as its lookup finishes, giving up on the rest after the deadline.
+    # The pool threads are shared by every session, so lookup errors are handed back and reported to `on_error`
+    # from the thread consuming this generator. `on_timeout` runs there too once the deadline has passed
+    def iter_location_details(self, ids, deadline, on_timeout=None):
+        if self.bulk_details:
+            with self.metrics.span("location_details", mode="bulk"):
+                result = self.bulk_location_details(ids)
+            for location_id in ids:
+                if result.get(location_id):
+                    yield result[location_id]
+            return
+
+        def fetch(location_id):
+            with self.metrics.span("location_details", mode="single"):
+                try:
+                    return self.location_details(location_id), None
+                except requests.exceptions.RequestException as e:
+                    return None, e
+
+        # Each lookup runs in a copy of this context so its trace logs keep the request ID
+        futures = {self.pool.submit(contextvars.copy_context().run, fetch, location_id): location_id
+                   for location_id in ids}
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                result, error = future.result()
+                if error is not None:
+                    self.on_error(error)
+                elif result:
+                    yield result
+        except TimeoutError:
+            for future in futures:
+                future.cancel()
+            if on_timeout is not None:
+                on_timeout()
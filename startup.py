@@ -0,0 +1,38 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Runs the slow start-up phases in order on a background thread and records how long each one took
+class Startup:
+    def __init__(self, phases):
+        self.phases = [name for name, _ in phases]
+        self.timings = {}
+        self.errors = {}
+        self._done = {name: threading.Event() for name in self.phases}
+        self._thread = threading.Thread(target=self._run, args=(phases,), name="startup", daemon=True)
+        self._thread.start()
+
+    def _run(self, phases):
+        for name, phase in phases:
+            start = time.perf_counter()
+            try:
+                phase()
+            except Exception as e:
+                self.errors[name] = e
+                logger.exception("Start-up phase '%s' failed", name)
+            self.timings[name] = time.perf_counter() - start
+            logger.info("Start-up phase '%s' took %.2fs", name, self.timings[name])
+            self._done[name].set()
+
+    def done(self, name):
+        return self._done[name].is_set()
+
+    def wait(self, name, timeout=None):
+        return self._done[name].wait(timeout)
+
+    # (phase, seconds or None while pending, error or None) for every phase
+    def report(self):
+        return [(name, self.timings.get(name), self.errors.get(name)) for name in self.phases]
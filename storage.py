@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import queue
+import random
+import hashlib
+import logging
+import threading
+
+from dedup import DEFAULT_RADIUS, NearDuplicateIndex, from_signed, hamming, phash, to_signed
+
+logger = logging.getLogger(__name__)
+
+BUCKET = "misclassified-images"
+ROOT_FOLDER = "Tmisclassified-images"
+MANIFEST_TABLE = "misclassified_image_hashes"
+RELEASE_FUNCTION = "release_image_hash"
+
+
+# Storage path for a contributed image, one folder per true class
+def image_path(image_hash, true_class):
+    return f"{ROOT_FOLDER}/{true_class}/{image_hash}.jpg"
+
+
+# Uploads contributed images, using a manifest table with a unique hash column to skip duplicates.
+# Known hashes are also kept in memory so most duplicates never reach the database, along with a perceptual
+# fingerprint index for images that aren't byte-identical but show the same thing.
+# `near_duplicates` is "reject" to drop them, "link" to record them in the manifest without uploading, or None
+class ImageStore:
+    def __init__(self, client, bucket=BUCKET, table=MANIFEST_TABLE, near_duplicates="reject",
+                 near_duplicate_radius=DEFAULT_RADIUS):
+        self.client = client
+        self.bucket = bucket
+        self.table = table
+        self.near_duplicates = near_duplicates
+        self.fingerprints = NearDuplicateIndex(near_duplicate_radius)
+        self._known = set()
+        self._lock = threading.Lock()
+
+    # The first 64 bits of the SHA-256 are plenty to tell images apart and keep the set small
+    @staticmethod
+    def _short(image_hash):
+        return int(image_hash[:16], 16)
+
+    def is_known(self, image_hash):
+        with self._lock:
+            return self._short(image_hash) in self._known
+
+    def remember(self, image_hashes):
+        with self._lock:
+            self._known.update(self._short(image_hash) for image_hash in image_hashes)
+
+    def remember_fingerprint(self, image_hash, fingerprint):
+        self.fingerprints.add(fingerprint, image_hash)
+
+    # The already contributed image this one is a near-duplicate of, as (image_hash, distance), or None
+    def find_near_duplicate(self, fingerprint, image_hash=None):
+        if self.near_duplicates is None:
+            return None
+        return self.fingerprints.find(fingerprint, exclude=image_hash)
+
+    # Loads every hash and fingerprint in the manifest page by page. Linked near-duplicates aren't indexed,
+    # the image they point to already covers them
+    def hydrate(self, page_size=1000):
+        start = 0
+        while True:
+            rows = self.client.table(self.table).select("hash, phash, duplicate_of").range(
+                start, start + page_size - 1
+            ).execute().data
+            self.remember(row["hash"] for row in rows)
+            for row in rows:
+                if row.get("phash") is not None and row.get("duplicate_of") is None:
+                    self.remember_fingerprint(row["hash"], from_signed(row["phash"]))
+            if len(rows) < page_size:
+                break
+            start += page_size
+        logger.info("Hydrated %d known image hashes and %d fingerprints", len(self._known), len(self.fingerprints))
+
+    def hydrate_in_background(self):
+        def run():
+            try:
+                self.hydrate()
+            except Exception:
+                logger.exception("Could not hydrate the image hash manifest")
+
+        threading.Thread(target=run, name="manifest-hydrate", daemon=True).start()
+
+    # Claims several hashes with one upsert and returns the ones this call inserted. Rows may carry the image's
+    # fingerprint and, for linked near-duplicates, the hash of the image they duplicate
+    def claim_many(self, rows):
+        if not rows:
+            return set()
+        response = self.client.table(self.table).upsert(
+            [{**row, "phash": to_signed(row["phash"])} if row.get("phash") is not None else row for row in rows],
+            on_conflict="hash",
+            ignore_duplicates=True
+        ).execute()
+        self.remember(row["hash"] for row in rows)
+        claimed = {row["hash"] for row in response.data}
+        for row in rows:
+            if row["hash"] in claimed and row.get("phash") is not None and row.get("duplicate_of") is None:
+                self.remember_fingerprint(row["hash"], row["phash"])
+        return claimed
+
+    def upload_object(self, image_bytes, image_hash, true_class, mime_type):
+        self.client.storage.from_(self.bucket).upload(
+            image_path(image_hash, true_class), image_bytes, {"content-type": mime_type}
+        )
+
+    # Gives up the claim on a hash whose upload failed. The anon key can't delete manifest rows, so this goes through
+    # a function that only removes recent claims without a stored image. Returns whether the claim was released
+    def release(self, image_hash):
+        if not self.client.rpc(RELEASE_FUNCTION, {"image_hash": image_hash}).execute().data:
+            return False
+        with self._lock:
+            self._known.discard(self._short(image_hash))
+        self.fingerprints.discard(image_hash)
+        return True
+
+
+# One contributed image waiting to be uploaded. `journal_id` is set once it has been written to disk, and
+# `claimed` once its manifest row belongs to this job but the object isn't uploaded yet
+class UploadJob:
+    def __init__(self, image_bytes, true_class, mime_type, journal_id=None, claimed=False):
+        self.image_bytes = image_bytes
+        self.true_class = true_class
+        self.mime_type = mime_type
+        self.image_hash = hashlib.sha256(image_bytes).hexdigest()
+        self.journal_id = journal_id
+        self.claimed = claimed
+        self.done = False
+        self.fingerprint = None
+        self.duplicate_of = None
+
+
+# Uploads contributed images on background workers so the Locations tab never waits on Supabase.
+# Manifest claims are written in batches, and jobs that can't be delivered are spilled to an on-disk
+# journal that is replayed until Supabase is reachable again
+class UploadQueue:
+    def __init__(self, store, workers=2, max_depth=100, batch_size=20, batch_wait=0.5, retries=3, backoff=1.0,
+                 journal_dir="cache/upload_journal", replay_interval=60):
+        self.store = store
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.journal_dir = journal_dir
+        self.replay_interval = replay_interval
+        self.uploaded = 0
+        self.duplicates = 0
+        self.near_duplicates = 0
+        self.failures = 0
+        self.spilled = 0
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._replaying = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(journal_dir, exist_ok=True)
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"upload-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._replay, name="upload-journal", daemon=True).start()
+
+    # Never blocks: when the queue is full the job goes straight to the journal
+    def submit(self, image_bytes, true_class, mime_type):
+        job = UploadJob(image_bytes, true_class, mime_type)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._spill(job)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    # Retries `action` with jittered exponential backoff, re-raising the last error
+    def _with_retries(self, action):
+        for attempt in range(self.retries + 1):
+            try:
+                return action()
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    # Fingerprints the job and looks for a near-duplicate among contributed images and the rest of the batch
+    def _check_near_duplicate(self, job, accepted):
+        if self.store.near_duplicates is None:
+            return None
+        if job.fingerprint is None:
+            try:
+                job.fingerprint = phash(job.image_bytes)
+            except ValueError:
+                # Unreadable images still get the exact-hash check
+                return None
+
+        match = self.store.find_near_duplicate(job.fingerprint, job.image_hash)
+        if match is not None:
+            return match[0]
+        for other in accepted:
+            if other.fingerprint is not None and other.duplicate_of is None and \
+                    hamming(other.fingerprint, job.fingerprint) <= self.store.fingerprints.radius:
+                return other.image_hash
+        return None
+
+    # Nothing a batch raises stops the worker: jobs it didn't finish go back to the journal
+    def _work(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception:
+                logger.exception("Upload worker failed on a batch of %d images", len(batch))
+                for job in batch:
+                    if not job.done:
+                        self._spill_or_drop(job)
+
+    def _process(self, batch):
+        # Jobs whose manifest row is already theirs only need the upload, everything else is claimed first
+        uploads = [job for job in batch if job.claimed]
+        # Jobs for the same image in one batch only need one upload
+        jobs = {}
+        for job in batch:
+            if job.claimed:
+                continue
+            if job.image_hash in jobs or self.store.is_known(job.image_hash):
+                self._finish(job, duplicate=True)
+                continue
+            job.duplicate_of = self._check_near_duplicate(job, jobs.values())
+            if job.duplicate_of is not None and self.store.near_duplicates == "reject":
+                self._finish(job, near_duplicate=True)
+            else:
+                jobs[job.image_hash] = job
+
+        try:
+            rows = [{"hash": h, "true_class": job.true_class, "phash": job.fingerprint,
+                     "duplicate_of": job.duplicate_of} for h, job in jobs.items()]
+            claimed = self._with_retries(lambda: self.store.claim_many(rows))
+        except Exception:
+            logger.exception("Could not write %d image hashes to the manifest", len(jobs))
+            for job in jobs.values():
+                self._spill_or_drop(job)
+            jobs = {}
+            claimed = set()
+
+        for image_hash, job in jobs.items():
+            if image_hash not in claimed:
+                self._finish(job, duplicate=True)
+            # Linked near-duplicates are only recorded in the manifest
+            elif job.duplicate_of is not None:
+                self._finish(job, near_duplicate=True)
+            else:
+                job.claimed = True
+                uploads.append(job)
+
+        for job in uploads:
+            self._upload(job)
+
+    # Journal entries of claimed jobs are only removed once the object is confirmed uploaded
+    def _upload(self, job):
+        try:
+            self._with_retries(lambda: self.store.upload_object(
+                job.image_bytes, job.image_hash, job.true_class, job.mime_type
+            ))
+        except Exception:
+            logger.exception("Could not upload image %s", job.image_hash)
+            self._count("failures")
+            # A claim that stays is remembered in the journal, so the replay goes straight to the upload
+            try:
+                job.claimed = not self.store.release(job.image_hash)
+            except Exception:
+                logger.exception("Could not release the manifest claim for %s", job.image_hash)
+            self._spill_or_drop(job)
+        else:
+            self._finish(job)
+
+    def _finish(self, job, duplicate=False, near_duplicate=False):
+        job.done = True
+        self._count("near_duplicates" if near_duplicate else "duplicates" if duplicate else "uploaded")
+        if job.journal_id is not None:
+            for suffix in (".json", ".bin"):
+                try:
+                    os.remove(os.path.join(self.journal_dir, job.journal_id + suffix))
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                self._replaying.discard(job.journal_id)
+
+    # Writes the image first and its metadata last, so a half-written entry is never replayed. The metadata is
+    # rewritten on every spill, since the job may have claimed its manifest row in the meantime
+    def _spill(self, job):
+        if job.journal_id is None:
+            job.journal_id = f"{time.time_ns()}-{job.image_hash[:16]}"
+            with open(os.path.join(self.journal_dir, job.journal_id + ".bin"), "wb") as f:
+                f.write(job.image_bytes)
+            self._count("spilled")
+        base = os.path.join(self.journal_dir, job.journal_id)
+        with open(base + ".json.tmp", "w") as f:
+            json.dump({"true_class": job.true_class, "mime_type": job.mime_type, "claimed": job.claimed}, f)
+        os.replace(base + ".json.tmp", base + ".json")
+        with self._lock:
+            self._replaying.discard(job.journal_id)
+
+    # Spills a job the worker couldn't deliver. If the journal can't be written either (e.g. the disk is full),
+    # the image is dropped and counted as a failure
+    def _spill_or_drop(self, job):
+        try:
+            self._spill(job)
+        except OSError:
+            logger.exception("Could not journal image %s, dropping it", job.image_hash)
+            job.done = True
+            self._count("failures")
+            with self._lock:
+                self._replaying.discard(job.journal_id)
+
+    def _replay(self):
+        while True:
+            for name in sorted(os.listdir(self.journal_dir)):
+                if not name.endswith(".json"):
+                    continue
+                journal_id = name[:-len(".json")]
+                with self._lock:
+                    if journal_id in self._replaying:
+                        continue
+                try:
+                    with open(os.path.join(self.journal_dir, name)) as f:
+                        meta = json.load(f)
+                    with open(os.path.join(self.journal_dir, journal_id + ".bin"), "rb") as f:
+                        image_bytes = f.read()
+                except (OSError, ValueError):
+                    logger.exception("Skipping unreadable journal entry %s", journal_id)
+                    continue
+
+                job = UploadJob(image_bytes, meta["true_class"], meta["mime_type"], journal_id=journal_id,
+                                claimed=meta.get("claimed", False))
+                with self._lock:
+                    self._replaying.add(journal_id)
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    with self._lock:
+                        self._replaying.discard(journal_id)
+                    break
+            time.sleep(self.replay_interval)
+
+    def journal_size(self):
+        return sum(1 for name in os.listdir(self.journal_dir) if name.endswith(".json"))
+
+    def stats(self):
+        return {
+            "depth": self._queue.qsize(),
+            "journal": self.journal_size(),
+            "uploaded": self.uploaded,
+            "duplicates": self.duplicates,
+            "near_duplicates": self.near_duplicates,
+            "failures": self.failures,
+            "spilled": self.spilled
+        }
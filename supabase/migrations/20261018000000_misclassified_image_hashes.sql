@@ -0,0 +1,13 @@
+-- One row per contributed image. The primary key on hash makes the duplicate check a single indexed upsert
+create table if not exists misclassified_image_hashes (
+    hash text primary key,
+    true_class text not null,
+    created_at timestamptz not null default now()
+);
+
+alter table misclassified_image_hashes enable row level security;
+
+-- The app reads the manifest at startup, claims new hashes and releases a claim when the upload fails
+create policy "app can read hashes" on misclassified_image_hashes for select to anon using (true);
+create policy "app can add hashes" on misclassified_image_hashes for insert to anon with check (true);
+create policy "app can release hashes" on misclassified_image_hashes for delete to anon using (true);
@@ -0,0 +1,6 @@
+-- Perceptual hash of each contributed image, stored as a signed 64-bit int, and for near-duplicates that were
+-- linked instead of uploaded, the hash of the image they duplicate. Filled for older rows by tools.fingerprint_images
+alter table misclassified_image_hashes add column if not exists phash bigint;
+alter table misclassified_image_hashes add column if not exists duplicate_of text;
+
+create index if not exists misclassified_image_hashes_duplicate_of on misclassified_image_hashes (duplicate_of);
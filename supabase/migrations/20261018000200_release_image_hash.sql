@@ -0,0 +1,28 @@
+-- Anyone with the anon key could delete any manifest row, and with it the record that stops an image from being
+-- contributed twice. Claims are now released through a function that only deletes rows that were claimed in the
+-- last day and whose image never made it to storage
+drop policy if exists "app can release hashes" on misclassified_image_hashes;
+
+create or replace function release_image_hash(image_hash text)
+returns boolean
+language sql
+security definer
+set search_path = public
+as $$
+    with released as (
+        delete from misclassified_image_hashes m
+        where m.hash = image_hash
+          and m.duplicate_of is null
+          and m.created_at > now() - interval '1 day'
+          and not exists (
+              select 1 from storage.objects o
+              where o.bucket_id = 'misclassified-images'
+                and o.name = 'Tmisclassified-images/' || m.true_class || '/' || m.hash || '.jpg'
+          )
+        returning 1
+    )
+    select exists (select 1 from released);
+$$;
+
+revoke all on function release_image_hash(text) from public;
+grant execute on function release_image_hash(text) to anon;
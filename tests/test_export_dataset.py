@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import hashlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from inference import class_names
+from storage import BUCKET, image_path
+from tools.export_dataset import export, labels_path
+from tools.fakes import FakeSupabase, sample_corpus
+
+
+# A small bucket laid out the way the app writes it, with lowercase class folders
+@pytest.fixture
+def bucket(tmp_path):
+    client = FakeSupabase(str(tmp_path / "storage"))
+    expected = {}
+    for class_name, path in sample_corpus(str(tmp_path / "corpus"), per_class=2, sizes=((320, 240),)):
+        with open(path, "rb") as f:
+            data = f.read()
+        image_hash = hashlib.sha256(data).hexdigest()
+        client.storage.from_(BUCKET).upload(image_path(image_hash, class_name.lower()), data)
+        expected[image_hash] = class_names.index(class_name)
+    return client, expected
+
+
+def test_export_labels_lowercase_folders(bucket, tmp_path):
+    client, expected = bucket
+    out_dir = str(tmp_path / "dataset")
+
+    assert export(client, BUCKET, out_dir, "npy", shard_size=5, download_workers=2, decode_workers=2) == \
+        (len(expected), 0)
+
+    db = sqlite3.connect(os.path.join(out_dir, "checkpoint.sqlite3"))
+    rows = db.execute("SELECT hash, shard, row FROM images").fetchall()
+    db.close()
+    assert len(rows) == len(expected)
+    for image_hash, shard, row in rows:
+        assert int(np.load(labels_path(os.path.join(out_dir, shard)))[row]) == expected[image_hash]
+
+
+def test_rerun_exports_nothing_new(bucket, tmp_path):
+    client, _ = bucket
+    out_dir = str(tmp_path / "dataset")
+    export(client, BUCKET, out_dir, "npy", shard_size=5, download_workers=2, decode_workers=2)
+
+    assert export(client, BUCKET, out_dir, "npy", shard_size=5, download_workers=2, decode_workers=2) == (0, 0)
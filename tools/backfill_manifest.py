@@ -0,0 +1,59 @@
+import os
+import argparse
+
+from storage import BUCKET, MANIFEST_TABLE, ROOT_FOLDER
+
+# One-off job that adds the images already in storage to the hash manifest
+#
+#   SUPABASE_URL=... SUPABASE_KEY=... python -m tools.backfill_manifest
+
+
+def list_existing(client, bucket):
+    page_size = 1000
+    for folder in client.storage.from_(bucket).list(ROOT_FOLDER):
+        true_class = folder["name"].strip("/")
+        offset = 0
+        while True:
+            files = client.storage.from_(bucket).list(
+                f"{ROOT_FOLDER}/{true_class}/", {"limit": page_size, "offset": offset}
+            )
+            for file in files:
+                if file["name"].endswith(".jpg"):
+                    yield file["name"][:-len(".jpg")], true_class
+            if len(files) < page_size:
+                break
+            offset += page_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the misclassified image hash manifest")
+    parser.add_argument("--url", default=os.environ.get("SUPABASE_URL"))
+    parser.add_argument("--key", default=os.environ.get("SUPABASE_KEY"))
+    parser.add_argument("--bucket", default=BUCKET)
+    parser.add_argument("--table", default=MANIFEST_TABLE)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    if not args.url or not args.key:
+        parser.error("Supabase credentials are required (--url/--key or SUPABASE_URL/SUPABASE_KEY)")
+
+    # Imported here so list_existing works without the supabase package, e.g. for export_dataset --local
+    from supabase import create_client
+    client = create_client(args.url, args.key)
+    batch = []
+    total = 0
+    for image_hash, true_class in list_existing(client, args.bucket):
+        batch.append({"hash": image_hash, "true_class": true_class})
+        if len(batch) >= args.batch_size:
+            client.table(args.table).upsert(batch, on_conflict="hash", ignore_duplicates=True).execute()
+            total += len(batch)
+            batch = []
+    if batch:
+        client.table(args.table).upsert(batch, on_conflict="hash", ignore_duplicates=True).execute()
+        total += len(batch)
+
+    print(f"Backfilled {total} image hashes into {args.table}")
+
+
+if __name__ == "__main__":
+    main()
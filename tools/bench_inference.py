@@ -0,0 +1,64 @@
+import json
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+from inference import IMG_SIZE, KerasBackend
+
+# Compares Keras model.predict with the traced inference function across batch sizes
+#
+#   python -m tools.bench_inference --model path/to/trashClassifier.keras [--xla]
+
+
+def time_calls(fn, batch, repeats, warmup=3):
+    for _ in range(warmup):
+        fn(batch)
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(batch)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model.predict against the compiled inference path")
+    parser.add_argument("--model", required=True, help="Path to trashClassifier.keras")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--xla", action="store_true", help="Also benchmark the XLA-compiled function")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    import keras
+
+    model = keras.models.load_model(args.model)
+    paths = {
+        "model.predict": lambda batch: model.predict(batch, verbose=0),
+        "compiled": KerasBackend(model).predict
+    }
+    if args.xla:
+        paths["compiled + xla"] = KerasBackend(model, jit_compile=True).predict
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f"{'path':<16}{'batch':>6}{'median ms':>12}{'p95 ms':>10}{'img/s':>10}")
+    for batch_size in args.batch_sizes:
+        batch = rng.random((batch_size, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        for name, fn in paths.items():
+            durations = sorted(time_calls(fn, batch, args.repeats))
+            median = statistics.median(durations)
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            results.append({"path": name, "batch_size": batch_size, "median_ms": median * 1000,
+                            "p95_ms": p95 * 1000, "images_per_s": batch_size / median})
+            print(f"{name:<16}{batch_size:>6}{median * 1000:>12.1f}{p95 * 1000:>10.1f}{batch_size / median:>10.0f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TieredCache
+from earth911 import DEFAULT_CACHE_TTLS, SPECIFIC_ITEMS, Earth911Client, MaterialTable
+from geo import LocationIndex, ZipIndex
+from inference import BatchScheduler, PredictionCache
+from llm import AdmissionController, ResponseStore
+from metrics import Metrics
+from pipeline import Locator, Predictor, generate_response, submit_contribution
+from storage import ImageStore, UploadQueue
+from tools.fakes import FakeBackend, FakeEarth911Server, FakeGeminiModel, FakeSupabase, Latency, sample_corpus
+
+# Runs the app's request path (predict, Gemini response, the Earth911 lookups and the misclassified upload)
+# against local fakes and reports per-stage and end-to-end latency, throughput and peak RSS
+#
+#   python -m tools.benchmark --requests 200 --concurrency 8 --out results/main.json
+#   python -m tools.benchmark --requests 200 --concurrency 8 --out results/branch.json --compare results/main.json
+
+ZIP_CODES = ["10001", "30301", "60601", "73301", "80201", "94103", "98101", "02108", "33101", "55401"]
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else None
+
+
+class Recorder:
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    # Times one stage. Exceptions are counted and re-raised so the request they belong to fails as a whole
+    def time(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors[stage] += 1
+            raise
+        finally:
+            with self._lock:
+                self.durations[stage].append(time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.durations[stage].append(seconds)
+
+    def summary(self):
+        summary = {}
+        for stage, durations in sorted(self.durations.items()):
+            ordered = sorted(durations)
+            summary[stage] = {
+                "count": len(ordered),
+                "errors": self.errors[stage],
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": percentile(ordered, 0.50) * 1000,
+                "p95_ms": percentile(ordered, 0.95) * 1000,
+                "p99_ms": percentile(ordered, 0.99) * 1000
+            }
+        return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Builds the services app.py loads and drives them through the same request path (pipeline.py)
+class Pipeline:
+    def __init__(self, args, workdir):
+        def latency(mean_ms, seed):
+            return Latency(mean_ms, mean_ms * args.jitter, args.error_rate, seed=seed)
+
+        if args.model and args.inference_workers:
+            from workers import ProcessBackend
+
+            self.backend = ProcessBackend(args.backend, args.model, workers=args.inference_workers,
+                                          max_batch=args.batch_max_size, cpu_affinity="spread")
+        elif args.model:
+            from inference import load_backend
+
+            def load_keras_model():
+                import keras
+                return keras.models.load_model(args.model)
+
+            self.backend = load_backend(args.backend, args.model, load_keras_model)
+        else:
+            self.backend = FakeBackend(latency(args.model_ms, 1), image_latency_ms=args.model_image_ms)
+        self.metrics = Metrics()
+        self.scheduler = BatchScheduler(self.backend.predict, args.batch_max_size, args.batch_max_wait_ms,
+                                        workers=args.inference_workers or 1)
+        self.prediction_cache = PredictionCache("benchmark", max_entries=args.prediction_cache_size)
+        self.predictor = Predictor(self.backend, self.scheduler, self.prediction_cache, self.metrics)
+
+        gemini = FakeGeminiModel(latency(args.gemini_ttft_ms, 2), latency(args.gemini_chunk_ms, 3))
+        self.responses = ResponseStore(
+            lambda prompt: gemini.generate_content(prompt).text,
+            lambda prompt: (chunk.text for chunk in gemini.generate_content(prompt, stream=True)),
+            limiter=AdmissionController(max_concurrent=args.gemini_max_concurrent),
+            deadline=args.gemini_deadline_s
+        )
+
+        self.earth911_server = FakeEarth911Server(default_latency=latency(args.earth911_ms, 4))
+        self.earth911 = Earth911Client("benchmark", base_url=self.earth911_server.base_url, backoff=0.01,
+                                       pool_size=args.earth911_workers)
+        self.earth911_cache = TieredCache(path=os.path.join(workdir, "earth911.sqlite3"), ttls=DEFAULT_CACHE_TTLS)
+        zip_path = os.path.join(workdir, "zip_centroids.npy")
+        ZipIndex.build([(int(zip_code), *self.earth911_server.postal_coordinates(zip_code))
+                        for zip_code in ZIP_CODES], zip_path)
+        self.earth911_pool = ThreadPoolExecutor(max_workers=args.earth911_workers, thread_name_prefix="earth911")
+
+        # A failed lookup fails the whole request instead of being shown to the user
+        def fail(e):
+            raise e
+
+        self.locator = Locator(
+            self.earth911,
+            self.earth911_cache,
+            ZipIndex.load(zip_path),
+            MaterialTable(self.earth911),
+            LocationIndex(),
+            self.earth911_pool,
+            self.metrics,
+            on_error=fail,
+            search_radius=args.search_radius,
+            search_max_results=args.search_max_results,
+            bulk_details=args.bulk_details
+        )
+        self.details_deadline = args.details_deadline_s
+
+        self.supabase = FakeSupabase(os.path.join(workdir, "storage"), latency(args.supabase_ms, 5))
+        self.images = ImageStore(self.supabase)
+        self.uploads = UploadQueue(self.images, journal_dir=os.path.join(workdir, "journal"), backoff=0.05)
+
+    def close(self):
+        self.earth911_pool.shutdown(wait=False, cancel_futures=True)
+        self.earth911_server.close()
+
+    def generate_response(self, recorder, prediction, confidence):
+        start = time.perf_counter()
+        chunks = []
+        for chunk in generate_response(self.responses, prediction, confidence):
+            if not chunks:
+                recorder.record("generate_response.ttft", time.perf_counter() - start)
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    def get_location_details(self, sites):
+        def timed_out():
+            raise TimeoutError("Location details missed the deadline")
+
+        ids = [site["location_id"] for site in sites]
+        return list(self.locator.iter_location_details(ids, self.details_deadline, on_timeout=timed_out))
+
+    def upload_misclassified_image(self, image_bytes, true_class):
+        submit_contribution(self.images, self.uploads, self.metrics, image_bytes, true_class, "image/jpeg")
+
+    # One user session: classify, read the reply, look up drop-off sites and report the image as misclassified
+    def request(self, recorder, image_bytes, true_class, zip_code, item):
+        prediction, confidence = recorder.time("predict", self.predictor.predict, image_bytes)
+        recorder.time("generate_response", self.generate_response, recorder, prediction, confidence)
+        lat, lon = recorder.time("get_postal_coordinates", self.locator.postal_coordinates, zip_code)
+        material_id = recorder.time("get_material_id", self.locator.material_id, item)
+        sites = recorder.time("get_dropoff_locations", self.locator.dropoff_locations, lat, lon, material_id)
+        recorder.time("get_location_details", self.get_location_details, sites)
+        if prediction != true_class:
+            recorder.time("upload_misclassified_image", self.upload_misclassified_image, image_bytes, true_class)
+
+
+def run(args):
+    corpus = [(class_name, open(path, "rb").read()) for class_name, path in
+              sample_corpus(args.corpus_dir, per_class=args.per_class, seed=args.seed)]
+    rng = random.Random(args.seed)
+    plan = []
+    for _ in range(args.requests):
+        true_class, image_bytes = rng.choice(corpus)
+        plan.append((true_class, image_bytes, rng.choice(ZIP_CODES), rng.choice(SPECIFIC_ITEMS[true_class])))
+
+    recorder = Recorder()
+    with tempfile.TemporaryDirectory() as workdir:
+        pipeline = Pipeline(args, workdir)
+
+        def session(step):
+            true_class, image_bytes, zip_code, item = step
+            start = time.perf_counter()
+            try:
+                pipeline.request(recorder, image_bytes, true_class, zip_code, item)
+            except Exception:
+                with recorder._lock:
+                    recorder.errors["end_to_end"] += 1
+            recorder.record("end_to_end", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(session, plan))
+        wall = time.perf_counter() - start
+
+        # Background uploads are part of the cost of a run even though sessions don't wait for them
+        drain_start = time.perf_counter()
+        while pipeline.uploads.stats()["depth"] and time.perf_counter() - drain_start < 60:
+            time.sleep(0.01)
+        recorder.record("upload_queue_drain", time.perf_counter() - drain_start)
+
+        results = {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+            "wall_s": wall,
+            "throughput_rps": args.requests / wall,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "stages": recorder.summary(),
+            "services": {
+                "batches": pipeline.scheduler.batches,
+                "prediction_cache": pipeline.prediction_cache.stats(),
+                "responses": pipeline.responses.stats(),
+                "earth911": pipeline.earth911.stats(),
+                "earth911_cache": pipeline.earth911_cache.stats(),
+                "earth911_calls": pipeline.earth911_server.calls,
+                "counters": pipeline.metrics.counters(),
+                "uploads": pipeline.uploads.stats()
+            }
+        }
+        pipeline.close()
+    return results
+
+
+def print_results(results):
+    print(f"commit {results['commit']}: {results['throughput_rps']:.1f} req/s, "
+          f"peak RSS {results['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<28}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, summary in results["stages"].items():
+        print(f"{stage:<28}{summary['count']:>7}{summary['errors']:>8}{summary['p50_ms']:>10.1f}"
+              f"{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}")
+
+
+# Prints the change against a baseline run and returns the stages whose p95 got worse by more than `tolerance`
+def compare(results, baseline, tolerance):
+    print(f"\nagainst {baseline['commit']}: throughput {baseline['throughput_rps']:.1f} -> "
+          f"{results['throughput_rps']:.1f} req/s, peak RSS {baseline['peak_rss_mb']:.0f} -> "
+          f"{results['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<28}{'p50':>10}{'p95':>10}{'p99':>10}")
+    regressions = []
+    for stage, summary in results["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old is None:
+            continue
+        changes = [(summary[q] - old[q]) / old[q] if old[q] else 0.0 for q in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{stage:<28}" + "".join(f"{change:>+10.1%}" for change in changes))
+        if changes[1] > tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the request path against local fakes")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", default="cache/benchmark_corpus")
+    parser.add_argument("--per-class", type=int, default=4, help="Sample images generated per class")
+    parser.add_argument("--model", help="Real model artifact to use instead of the fake backend")
+    parser.add_argument("--backend", choices=["keras", "tflite"], default="keras")
+    parser.add_argument("--inference-workers", type=int, default=0,
+                        help="With --model, run it in this many worker processes")
+    parser.add_argument("--batch-max-size", type=int, default=16)
+    parser.add_argument("--batch-max-wait-ms", type=float, default=10)
+    parser.add_argument("--prediction-cache-size", type=int, default=1024)
+    parser.add_argument("--model-ms", type=float, default=40, help="Fake backend cost per batch")
+    parser.add_argument("--model-image-ms", type=float, default=5, help="Fake backend cost per image")
+    parser.add_argument("--gemini-ttft-ms", type=float, default=600)
+    parser.add_argument("--gemini-chunk-ms", type=float, default=50)
+    parser.add_argument("--earth911-ms", type=float, default=150)
+    parser.add_argument("--supabase-ms", type=float, default=120)
+    parser.add_argument("--gemini-max-concurrent", type=int, default=4)
+    parser.add_argument("--gemini-deadline-s", type=float, default=15)
+    parser.add_argument("--earth911-workers", type=int, default=8, help="Concurrent Earth911 lookups")
+    parser.add_argument("--search-radius", type=float, default=50, help="Radius in miles of Earth911 searches")
+    parser.add_argument("--search-max-results", type=int, default=50, help="Sites requested per Earth911 search")
+    parser.add_argument("--details-deadline-s", type=float, default=8)
+    parser.add_argument("--bulk-details", action="store_true", help="Fetch location details in one request")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Latency standard deviation as a share of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake service calls that fail")
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p95 slowdown before failing")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\np95 regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
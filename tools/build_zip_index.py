@@ -0,0 +1,30 @@
+import argparse
+
+from geo import GAZETTEER_URL, ZipIndex, download_zip_index, read_gazetteer
+
+# Builds the offline ZIP index from the Census Bureau's ZCTA Gazetteer file
+# (https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html), either a local
+# copy or, without one, the file downloaded from the Census Bureau. Run it as part of the deployment, or let the
+# app build the index on its first start
+#
+#   python -m tools.build_zip_index 2023_Gaz_zcta_national.txt
+#   python -m tools.build_zip_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline ZIP code -> coordinates index")
+    parser.add_argument("gazetteer", nargs="?", help="Census ZCTA Gazetteer file (tab separated)")
+    parser.add_argument("--url", default=GAZETTEER_URL, help="Zipped Gazetteer file to download without one")
+    parser.add_argument("--out", default="data/zip_centroids.npy", help="Where to write the index")
+    args = parser.parse_args()
+
+    if args.gazetteer:
+        with open(args.gazetteer, newline="", encoding="utf-8") as f:
+            count = ZipIndex.build(read_gazetteer(f), args.out)
+    else:
+        count = download_zip_index(args.out, args.url)
+    print(f"Wrote {count} ZIP codes to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
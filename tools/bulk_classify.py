@@ -0,0 +1,127 @@
+import os
+import csv
+import sys
+import time
+import zipfile
+import argparse
+
+import numpy as np
+
+from inference import classify_many, load_backend
+
+# Classifies every image in a folder or zip file and writes the results as they come in
+#
+#   python -m tools.bulk_classify photos/ --out results.csv
+#   python -m tools.bulk_classify audit.zip --out results.parquet --backend tflite
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+COLUMNS = ["file", "class", "confidence", "error"]
+
+
+def folder_sources(path):
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                full_path = os.path.join(root, name)
+                yield os.path.relpath(full_path, path), lambda p=full_path: np.fromfile(p, dtype=np.uint8)
+
+
+def zip_sources(archive):
+    for info in archive.infolist():
+        if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+            yield info.filename, lambda i=info: archive.read(i)
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="") if path != "-" else sys.stdout
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+# Buffers a row group at a time so memory doesn't grow with the number of images
+class ParquetWriter:
+    def __init__(self, path, row_group_size=1024):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([("file", pa.string()), ("class", pa.string()),
+                                 ("confidence", pa.float64()), ("error", pa.string())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+        self.rows = []
+
+    def _flush(self):
+        if self.rows:
+            columns = list(zip(*self.rows))
+            self.writer.write_table(self.pa.Table.from_arrays([self.pa.array(c) for c in columns], schema=self.schema))
+            self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a folder or zip of images")
+    parser.add_argument("input", help="Folder or .zip file of images")
+    parser.add_argument("--out", default="-", help="Output .csv or .parquet file (default: CSV on stdout)")
+    parser.add_argument("--model", help="Path to trashClassifier.keras (downloaded from the Hub if omitted)")
+    parser.add_argument("--backend", default="keras", choices=["keras", "tflite"])
+    parser.add_argument("--calibration-dir", default=os.environ.get("TFLITE_CALIBRATION_DIR"),
+                        help="Folder of real photos to quantize and check the TFLite model with "
+                             "(default: $TFLITE_CALIBRATION_DIR). Without about 70 photos tflite falls back to Keras")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Decode threads")
+    args = parser.parse_args()
+
+    model_path = args.model
+    if model_path is None:
+        from huggingface_hub import hf_hub_download
+        model_path = hf_hub_download(repo_id="AIforGreat/TrashClassification", filename="trashClassifier.keras")
+
+    def load_keras_model():
+        import keras
+        return keras.models.load_model(model_path)
+
+    backend = load_backend(args.backend, model_path, load_keras_model, calibration_dir=args.calibration_dir)
+
+    archive = None
+    if zipfile.is_zipfile(args.input):
+        archive = zipfile.ZipFile(args.input)
+        sources = zip_sources(archive)
+    else:
+        sources = folder_sources(args.input)
+
+    writer = ParquetWriter(args.out) if args.out.endswith(".parquet") else CsvWriter(args.out)
+    start = time.perf_counter()
+    count = 0
+    try:
+        for row in classify_many(sources, backend, batch_size=args.batch_size, workers=args.workers):
+            writer.write(row)
+            count += 1
+    finally:
+        writer.close()
+        if archive is not None:
+            archive.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Classified {count} images in {elapsed:.1f}s ({count / max(elapsed, 1e-9) * 60:.0f} images/min)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from inference import IMG_SIZE, ImageRejectedError, class_names, preprocess
+from storage import BUCKET, image_path
+from tools.backfill_manifest import list_existing
+
+# Exports the contributed images into sharded training files: 224x224 RGB uint8 pixels with the class index as
+# label, either as TFRecord shards or as .npy pairs that can be memory-mapped. Images stream through a bounded
+# window (download threads, then decode processes, then the open shard), so memory doesn't grow with the bucket.
+# Exported hashes are checkpointed in SQLite after every shard, so a rerun only exports new images
+#
+#   SUPABASE_URL=... SUPABASE_KEY=... python -m tools.export_dataset --out datasets/contributed
+#   python -m tools.export_dataset --local storage_copy/ --out datasets/local --format npy
+
+# The app files contributions under lowercase class folders (battery/, brown-glass/...)
+FOLDER_CLASSES = {class_name.lower(): class_name for class_name in class_names}
+
+
+# Runs in a worker process
+def _decode(image_bytes):
+    try:
+        return preprocess(image_bytes, dtype=np.uint8), None
+    except (ImageRejectedError, OSError) as e:
+        return None, str(e)
+
+
+# Each record holds the raw pixels so training doesn't decode JPEGs again
+class TFRecordShardWriter:
+    extension = ".tfrecord"
+
+    def __init__(self, path, shard_size):
+        import tensorflow as tf
+
+        self.tf = tf
+        self.writer = tf.io.TFRecordWriter(path)
+        self.count = 0
+
+    def write(self, image_hash, label, img):
+        tf = self.tf
+        example = tf.train.Example(features=tf.train.Features(feature={
+            "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[img.tobytes()])),
+            "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+            "hash": tf.train.Feature(bytes_list=tf.train.BytesList(value=[image_hash.encode()]))
+        }))
+        self.writer.write(example.SerializeToString())
+        self.count += 1
+
+    def close(self):
+        self.writer.close()
+
+
+def labels_path(path):
+    return path[:-len(".npy")] + ".labels.npy"
+
+
+# <shard>.npy holds the (n, 224, 224, 3) images and <shard>.labels.npy the class indices. Rows are written
+# straight into a memory-mapped file, so a shard is never held in memory
+class NpyShardWriter:
+    extension = ".npy"
+
+    def __init__(self, path, shard_size):
+        self.path = path
+        self.images = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8,
+                                                shape=(shard_size, IMG_SIZE, IMG_SIZE, 3))
+        self.labels = np.empty(shard_size, dtype=np.int16)
+        self.count = 0
+
+    def write(self, image_hash, label, img):
+        self.images[self.count] = img
+        self.labels[self.count] = label
+        self.count += 1
+
+    def close(self):
+        self.images.flush()
+        if self.count < len(self.images):
+            # The last shard is usually short, so it is copied into a file of the right size
+            trimmed_path = self.path + ".trim"
+            trimmed = np.lib.format.open_memmap(trimmed_path, mode="w+", dtype=np.uint8,
+                                                shape=(self.count, IMG_SIZE, IMG_SIZE, 3))
+            trimmed[:] = self.images[:self.count]
+            trimmed.flush()
+            del trimmed
+            os.replace(trimmed_path, self.path)
+        del self.images
+        np.save(labels_path(self.path), self.labels[:self.count])
+
+
+WRITERS = {"tfrecord": TFRecordShardWriter, "npy": NpyShardWriter}
+
+
+# Which hashes are already in a finished shard, and the shards written so far
+class Checkpoint:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS shards (
+                    name TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    classes TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    hash TEXT PRIMARY KEY,
+                    true_class TEXT NOT NULL,
+                    shard TEXT NOT NULL,
+                    row INTEGER NOT NULL
+                )
+            """)
+
+    def exported(self, image_hash):
+        return self.db.execute("SELECT 1 FROM images WHERE hash = ?", (image_hash,)).fetchone() is not None
+
+    def next_shard_index(self):
+        return self.db.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+
+    def commit_shard(self, name, rows):
+        classes = Counter(true_class for _, true_class in rows)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?)",
+                            (name, len(rows), json.dumps(classes), time.time()))
+            self.db.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                                [(image_hash, true_class, name, row)
+                                 for row, (image_hash, true_class) in enumerate(rows)])
+
+    def shards(self):
+        return [{"name": name, "count": count, "classes": json.loads(classes)}
+                for name, count, classes in self.db.execute("SELECT name, count, classes FROM shards ORDER BY name")]
+
+    def close(self):
+        self.db.close()
+
+
+def write_manifest(out_dir, data_format, checkpoint):
+    shards = checkpoint.shards()
+    manifest = {
+        "format": data_format,
+        "image_size": IMG_SIZE,
+        "dtype": "uint8",
+        "class_names": class_names,
+        "count": sum(shard["count"] for shard in shards),
+        "shards": shards
+    }
+    tmp_path = os.path.join(out_dir, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, "manifest.json"))
+
+
+# Yields (image_hash, true_class, img, error) for every source in listing order. At most `window` images are
+# downloaded or decoded at once
+def load_images(bucket, sources, download_workers, decode_workers, window):
+    context = multiprocessing.get_context("spawn")
+    with ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="export-download") as threads, \
+            ProcessPoolExecutor(max_workers=decode_workers, mp_context=context) as processes:
+
+        def load(source):
+            image_hash, true_class = source
+            try:
+                image_bytes = bucket.download(image_path(image_hash, true_class))
+            except Exception as e:
+                return image_hash, true_class, None, f"download failed: {e}"
+            return (image_hash, true_class, *processes.submit(_decode, image_bytes).result())
+
+        sources = iter(sources)
+        pending = deque()
+        while True:
+            while len(pending) < window:
+                source = next(sources, None)
+                if source is None:
+                    break
+                pending.append(threads.submit(load, source))
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+
+def export(client, bucket_name, out_dir, data_format="tfrecord", shard_size=1000, download_workers=8,
+           decode_workers=None, window=None):
+    # Shards are written here and moved next to the manifest once complete
+    tmp_dir = os.path.join(out_dir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(out_dir, "checkpoint.sqlite3"))
+    writer_class = WRITERS[data_format]
+    decode_workers = decode_workers or os.cpu_count() or 2
+    window = window or 2 * max(download_workers, decode_workers)
+
+    sources = (source for source in list_existing(client, bucket_name)
+               if source[1].lower() in FOLDER_CLASSES and not checkpoint.exported(source[0]))
+    images = load_images(client.storage.from_(bucket_name), sources, download_workers, decode_workers, window)
+
+    exported = failed = 0
+    writer = rows = None
+    try:
+        for image_hash, folder, img, error in images:
+            if error is not None:
+                # Not checkpointed, so it is tried again on the next run
+                print(f"Skipping {folder}/{image_hash}: {error}")
+                failed += 1
+                continue
+
+            if writer is None:
+                name = f"part-{checkpoint.next_shard_index():05d}{writer_class.extension}"
+                tmp_path = os.path.join(tmp_dir, name)
+                writer = writer_class(tmp_path, shard_size)
+                rows = []
+            true_class = FOLDER_CLASSES[folder.lower()]
+            writer.write(image_hash, class_names.index(true_class), img)
+            rows.append((image_hash, true_class))
+
+            if writer.count == shard_size:
+                _finish_shard(writer, tmp_path, out_dir, name, rows, checkpoint, data_format)
+                exported += len(rows)
+                writer = None
+
+        if writer is not None:
+            _finish_shard(writer, tmp_path, out_dir, name, rows, checkpoint, data_format)
+            exported += len(rows)
+            writer = None
+    finally:
+        # An unfinished shard is dropped, its images are exported again on the next run
+        if writer is not None:
+            writer.close()
+        checkpoint.close()
+    return exported, failed
+
+
+# Moves a finished shard into place, then checkpoints it. A crash in between leaves a file that the next run
+# overwrites, since the shard name is only taken once it is checkpointed
+def _finish_shard(writer, tmp_path, out_dir, name, rows, checkpoint, data_format):
+    writer.close()
+    os.replace(tmp_path, os.path.join(out_dir, name))
+    if data_format == "npy":
+        os.replace(labels_path(tmp_path), labels_path(os.path.join(out_dir, name)))
+    checkpoint.commit_shard(name, rows)
+    write_manifest(out_dir, data_format, checkpoint)
+    print(f"Wrote {name} ({len(rows)} images)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the contributed images as a sharded training dataset")
+    parser.add_argument("--out", required=True, help="Output folder for the shards, manifest and checkpoint")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="tfrecord")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Images per shard")
+    parser.add_argument("--download-workers", type=int, default=8)
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count() or 2, help="Decode processes")
+    parser.add_argument("--url", default=os.environ.get("SUPABASE_URL"))
+    parser.add_argument("--key", default=os.environ.get("SUPABASE_KEY"))
+    parser.add_argument("--bucket", default=BUCKET)
+    parser.add_argument("--local", metavar="DIR",
+                        help="Read DIR/<bucket>/Tmisclassified-images/<class>/<hash>.jpg instead of Supabase")
+    args = parser.parse_args()
+
+    if args.local:
+        from tools.fakes import FakeSupabase
+        client = FakeSupabase(args.local)
+    elif args.url and args.key:
+        from supabase import create_client
+        client = create_client(args.url, args.key)
+    else:
+        parser.error("Supabase credentials are required (--url/--key or SUPABASE_URL/SUPABASE_KEY), or --local")
+
+    start = time.perf_counter()
+    exported, failed = export(client, args.bucket, args.out, args.format, args.shard_size,
+                              args.download_workers, args.decode_workers)
+    print(f"Exported {exported} new images ({failed} failed) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import os
+import json
+import math
+import time
+import random
+import zlib
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from inference import class_names
+from storage import BUCKET, MANIFEST_TABLE, RELEASE_FUNCTION, image_path
+
+# Local stand-ins for Gemini, Earth911, Supabase and the model, with configurable latency and error injection,
+# used by the benchmark and load-test tools so they run offline and reproducibly
+
+
+# Sleeps for a normally distributed delay and raises for a configurable share of calls
+class Latency:
+    def __init__(self, mean_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, scale=1.0):
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.mean_ms, self.jitter_ms)) * scale
+            failed = self._random.random() < self.error_rate
+        time.sleep(delay / 1000)
+        if failed:
+            raise RuntimeError("Injected failure")
+
+
+# Deterministic set of JPEGs across the 12 classes, including full-size phone photos
+def sample_corpus(directory, per_class=4, seed=0, sizes=((4032, 3024), (1920, 1080), (640, 480), (224, 224))):
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    for class_index, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        os.makedirs(class_dir, exist_ok=True)
+        for i in range(per_class):
+            path = os.path.join(class_dir, f"{i}.jpg")
+            paths.append((class_name, path))
+            if os.path.exists(path):
+                continue
+            width, height = sizes[i % len(sizes)]
+            # A class-specific colour with a gradient and some noise, so images compress like photos
+            base = np.array([(class_index * 37) % 256, (class_index * 91) % 256, (class_index * 53) % 256])
+            gradient = np.linspace(0, 64, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+            noise = rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+            img = np.clip(base + gradient + noise, 0, 255).astype(np.uint8)
+            cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return paths
+
+
+# Stand-in for the inference backends: fixed per-batch and per-image cost, probabilities derived from the pixels
+class FakeBackend:
+    name = "fake"
+    input_dtype = np.float32
+
+    def __init__(self, batch_latency=None, image_latency_ms=0.0):
+        self.batch_latency = batch_latency or Latency()
+        self.image_latency_ms = image_latency_ms
+
+    def predict(self, batch):
+        self.batch_latency.wait()
+        time.sleep(len(batch) * self.image_latency_ms / 1000)
+        logits = np.stack([np.roll(np.arange(len(class_names), dtype=np.float32), int(img.mean() * 97))
+                           for img in batch])
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+# Mimics google.generativeai.GenerativeModel: a first-token delay, then chunks at a steady pace
+class FakeGeminiModel:
+    def __init__(self, first_token=None, chunk_latency=None, chunks=12):
+        self.first_token = first_token or Latency()
+        self.chunk_latency = chunk_latency or Latency()
+        self.chunks = chunks
+        self.calls = 0
+
+    def _chunks(self, prompt):
+        self.calls += 1
+        self.first_token.wait()
+        words = f"This looks recyclable! Here is a fun fact about it. {prompt[-60:]}".split()
+        size = max(1, len(words) // self.chunks)
+        for i in range(0, len(words), size):
+            if i:
+                self.chunk_latency.wait()
+            text = " ".join(words[i:i + size]) + " "
+            yield SimpleNamespace(text=text, parts=[text])
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        if stream:
+            return self._chunks(prompt)
+        text = "".join(chunk.text for chunk in self._chunks(prompt))
+        return SimpleNamespace(text=text, parts=[text])
+
+
+def _stable(value):
+    return zlib.crc32(str(value).encode())
+
+
+# Answers the four Earth911 endpoints the app uses with deterministic data
+class _Earth911Handler(BaseHTTPRequestHandler):
+    server_version = "FakeEarth911/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        endpoint = url.path.rsplit(".", 1)[-1]
+        fake = self.server.fake
+        fake.calls[endpoint] = fake.calls.get(endpoint, 0) + 1
+
+        try:
+            fake.latency.get(endpoint, fake.default_latency).wait()
+        except RuntimeError:
+            self._send(503, {"error": "injected failure"})
+            return
+
+        handler = getattr(fake, f"_{endpoint}", None)
+        if handler is None:
+            self._send(404, {"error": f"unknown endpoint {endpoint}"})
+            return
+        self._send(200, {"result": handler(params)})
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeEarth911Server:
+    def __init__(self, latency=None, default_latency=None, sites_per_search=30):
+        self.latency = latency or {}
+        self.default_latency = default_latency or Latency()
+        self.sites_per_search = sites_per_search
+        self.calls = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Earth911Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/"
+        threading.Thread(target=self._server.serve_forever, name="fake-earth911", daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Deterministic coordinates for a ZIP code, also used to build a matching ZIP index
+    def postal_coordinates(self, zip_code):
+        code = _stable(zip_code)
+        return 25 + (code % 2300) / 100, -124 + (code // 2300 % 5700) / 100
+
+    def _getPostalData(self, params):
+        lat, lon = self.postal_coordinates(params["postal_code"][0])
+        return {"latitude": lat, "longitude": lon}
+
+    def _searchMaterials(self, params):
+        return [{"material_id": f"m{_stable(params['query'][0]) % 100000}", "description": params["query"][0]}]
+
+    def _searchLocations(self, params):
+        lat, lon = float(params["latitude"][0]), float(params["longitude"][0])
+        radius = float(params["max_distance"][0])
+        count = min(int(params["max_results"][0]), self.sites_per_search)
+        rng = random.Random(_stable(f"{lat:.2f}{lon:.2f}{params['material_id'][0]}"))
+        sites = []
+        for _ in range(count):
+            distance = radius * math.sqrt(rng.random())
+            angle = rng.random() * 2 * math.pi
+            site_lat = lat + distance / 69.0 * math.sin(angle)
+            site_lon = lon + distance / (69.0 * math.cos(math.radians(lat))) * math.cos(angle)
+            location_id = f"L{_stable(f'{site_lat:.4f}{site_lon:.4f}')}"
+            sites.append({"location_id": location_id, "latitude": site_lat, "longitude": site_lon,
+                          "description": f"Drop-off {location_id}", "distance": distance})
+        return sorted(sites, key=lambda site: site["distance"])
+
+    def _getLocationDetails(self, params):
+        ids = params.get("location_id", []) + params.get("location_id[]", [])
+        return {location_id: {"description": f"Drop-off {location_id}", "address": "1 Recycling Way",
+                              "url": "https://example.com", "phone": "555-0100", "hours": "9am - 5pm"}
+                for location_id in ids}
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+# Enough of the supabase-py table query builder for the hash manifest
+class _FakeTable:
+    def __init__(self, fake, name):
+        self.fake = fake
+        self.rows = fake.tables.setdefault(name, {})
+        self._action = None
+
+    def select(self, columns="*"):
+        self._action = ("select", columns)
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def upsert(self, rows, on_conflict="", ignore_duplicates=False):
+        self._action = ("upsert", rows if isinstance(rows, list) else [rows], on_conflict)
+        return self
+
+    def execute(self):
+        self.fake.latency.wait()
+        with self.fake.lock:
+            if self._action[0] == "select":
+                start, end = getattr(self, "_range", (0, len(self.rows) - 1))
+                return _Result(list(self.rows.values())[start:end + 1])
+            inserted = []
+            for row in self._action[1]:
+                key = row[self._action[2] or "hash"]
+                if key not in self.rows:
+                    self.rows[key] = dict(row)
+                    inserted.append(dict(row))
+            return _Result(inserted)
+
+
+# Storage bucket backed by a local directory, mirroring the supabase-py storage calls the app uses
+class _FakeBucket:
+    def __init__(self, fake, name):
+        self.fake = fake
+        self.root = os.path.join(fake.root, name)
+
+    def upload(self, path, data, options=None):
+        self.fake.latency.wait(self.fake.upload_scale)
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(data)
+        return SimpleNamespace(path=path)
+
+    def download(self, path):
+        self.fake.latency.wait()
+        with open(os.path.join(self.root, path), "rb") as f:
+            return f.read()
+
+    def list(self, path=None, options=None):
+        self.fake.latency.wait()
+        options = options or {}
+        directory = os.path.join(self.root, path or "")
+        if not os.path.isdir(directory):
+            return []
+        names = sorted(os.listdir(directory))
+        offset = options.get("offset", 0)
+        names = names[offset:offset + options.get("limit", 100)]
+        return [{"name": name, "id": None if os.path.isdir(os.path.join(directory, name)) else name}
+                for name in names]
+
+
+class FakeSupabase:
+    def __init__(self, root, latency=None, upload_scale=1.0):
+        self.root = root
+        self.latency = latency or Latency()
+        self.upload_scale = upload_scale
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.storage = SimpleNamespace(from_=lambda bucket: _FakeBucket(self, bucket))
+
+    def table(self, name):
+        return _FakeTable(self, name)
+
+    # The manifest's release function: deletes the claim unless the image is already stored or linked
+    def rpc(self, name, params):
+        if name != RELEASE_FUNCTION:
+            raise ValueError(f"unknown function {name}")
+
+        def release():
+            self.latency.wait()
+            with self.lock:
+                rows = self.tables.get(MANIFEST_TABLE, {})
+                row = rows.get(params["image_hash"])
+                stored = row is not None and os.path.exists(
+                    os.path.join(self.root, BUCKET, image_path(row["hash"], row["true_class"]))
+                )
+                if row is None or stored or row.get("duplicate_of"):
+                    return _Result(False)
+                del rows[row["hash"]]
+                return _Result(True)
+
+        return SimpleNamespace(execute=release)
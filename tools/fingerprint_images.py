@@ -0,0 +1,92 @@
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from supabase import create_client
+
+from dedup import DEFAULT_RADIUS, NearDuplicateIndex, from_signed, phash, to_signed
+from storage import BUCKET, MANIFEST_TABLE, image_path
+from tools.backfill_manifest import list_existing
+
+# One-off job that computes the perceptual hash of every image already in storage and
+# writes it to the manifest, so the upload workers can spot near-duplicates of them. Updating existing rows
+# needs the service-role key. With --link, near-duplicates found among the existing images are marked too
+#
+#   SUPABASE_URL=... SUPABASE_KEY=<service role key> python -m tools.fingerprint_images [--link]
+
+
+def load_fingerprints(client, table, page_size=1000):
+    fingerprints = {}
+    start = 0
+    while True:
+        rows = client.table(table).select("hash, phash").range(start, start + page_size - 1).execute().data
+        for row in rows:
+            fingerprints[row["hash"]] = from_signed(row["phash"]) if row.get("phash") is not None else None
+        if len(rows) < page_size:
+            return fingerprints
+        start += page_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint the contributed images for near-duplicate detection")
+    parser.add_argument("--url", default=os.environ.get("SUPABASE_URL"))
+    parser.add_argument("--key", default=os.environ.get("SUPABASE_KEY"))
+    parser.add_argument("--bucket", default=BUCKET)
+    parser.add_argument("--table", default=MANIFEST_TABLE)
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent downloads")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--radius", type=int, default=DEFAULT_RADIUS)
+    parser.add_argument("--force", action="store_true", help="Recompute fingerprints that are already stored")
+    parser.add_argument("--link", action="store_true", help="Mark near-duplicates of earlier images in the manifest")
+    args = parser.parse_args()
+
+    if not args.url or not args.key:
+        parser.error("Supabase credentials are required (--url/--key or SUPABASE_URL/SUPABASE_KEY)")
+
+    client = create_client(args.url, args.key)
+    bucket = client.storage.from_(args.bucket)
+    known = load_fingerprints(client, args.table)
+    index = NearDuplicateIndex(args.radius)
+
+    def fingerprint(item):
+        image_hash, true_class = item
+        if not args.force and known.get(image_hash) is not None:
+            return image_hash, true_class, known[image_hash], False
+        try:
+            return image_hash, true_class, phash(bucket.download(image_path(image_hash, true_class))), True
+        except Exception as e:
+            print(f"Skipping {true_class}/{image_hash}: {e}")
+            return image_hash, true_class, None, False
+
+    batch = []
+    computed = linked = 0
+
+    def flush():
+        if batch:
+            client.table(args.table).upsert(batch, on_conflict="hash").execute()
+            batch.clear()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for image_hash, true_class, value, new in pool.map(fingerprint, list_existing(client, args.bucket)):
+            if value is None:
+                continue
+            row = {"hash": image_hash, "true_class": true_class, "phash": to_signed(value)}
+            match = index.find(value)
+            if match is None:
+                index.add(value, image_hash)
+            elif args.link:
+                row["duplicate_of"] = match[0]
+                linked += 1
+            if new or "duplicate_of" in row:
+                computed += new
+                batch.append(row)
+            if len(batch) >= args.batch_size:
+                flush()
+    flush()
+
+    print(f"Fingerprinted {computed} images, {len(index)} distinct" + (f", {linked} linked as near-duplicates"
+                                                                     if args.link else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from queue import Empty
+from types import ModuleType
+
+from geo import ZipIndex
+from storage import MANIFEST_TABLE
+from tools.benchmark import ZIP_CODES, Recorder, git_commit
+from tools.fakes import FakeBackend, FakeEarth911Server, FakeGeminiModel, FakeSupabase, Latency, sample_corpus
+
+# Drives many concurrent headless sessions of app.py through Streamlit's AppTest: open the page, upload a photo,
+# Analyze, then search the Locations tab (sometimes reporting the image as misclassified). Gemini, Earth911,
+# Supabase and, unless --model is given, the model are replaced by the local stand-ins in tools.fakes.
+# AppTest swaps Streamlit's process-wide runtime in and out around every script run, so sessions in one process
+# trample each other. Each simulated user therefore runs in its own process with its own cached resources, like
+# one server process per user, sharing the on-disk caches and indexes and one fake Earth911 server.
+# Concurrency ramps up step by step, and each step reports latency percentiles, the error rate and the combined
+# CPU and RSS of the user processes
+#
+#   python -m tools.loadtest --steps 1,2,4,8,16 --step-duration 30 --out results/loadtest.json
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+# Session state key the stand-in file uploader reads the session's photo from
+UPLOAD_KEY = "_loadtest_upload"
+
+
+class SessionError(Exception):
+    pass
+
+
+# What st.file_uploader returns: the file's bytes with its name and MIME type
+class Upload(io.BytesIO):
+    def __init__(self, name, data, type="image/jpeg"):
+        super().__init__(data)
+        self.name = name
+        self.type = type
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+# Points this process's app at the fakes and returns the secrets every session runs with. `index` tells the
+# user processes' fake latencies apart
+def install_stubs(args, workdir, earth911_url, zip_index_path, index=0):
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    import inference
+
+    def latency(mean_ms, seed):
+        return Latency(mean_ms, mean_ms * args.jitter, args.error_rate, seed=args.seed * 1000 + index * 10 + seed)
+
+    gemini = FakeGeminiModel(latency(args.gemini_ttft_ms, 2), latency(args.gemini_chunk_ms, 3))
+    genai = ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = lambda name: gemini
+    try:
+        import google
+    except ImportError:
+        google = sys.modules["google"] = ModuleType("google")
+        google.__path__ = []
+    google.generativeai = sys.modules["google.generativeai"] = genai
+
+    supabase_client = FakeSupabase(os.path.join(workdir, "storage"), latency(args.supabase_ms, 5))
+    supabase = ModuleType("supabase")
+    supabase.create_client = lambda url, key: supabase_client
+    sys.modules["supabase"] = supabase
+
+    if args.model:
+        model_path = args.model
+    else:
+        # model_version() hashes the artifact, so the fake backend still needs a file
+        model_path = os.path.join(workdir, "fake_model.keras")
+        with open(model_path, "wb") as f:
+            f.write(b"fake")
+        backend = FakeBackend(latency(args.model_ms, 1), image_latency_ms=args.model_image_ms)
+        inference.load_backend = lambda name, path, load_keras_model, **options: backend
+
+    # AppTest has no file uploader widget to drive, so the uploader hands out the photo the harness put in
+    # the session's state
+    file_uploader = st.file_uploader
+
+    def fake_file_uploader(label, *args, **kwargs):
+        if label == "Please select a file":
+            upload = st.session_state.get(UPLOAD_KEY)
+            return Upload(*upload) if upload else None
+        return file_uploader(label, *args, **kwargs)
+
+    st.file_uploader = fake_file_uploader
+
+    secrets = {
+        "GEMINI_API_KEY": "loadtest",
+        "EARTH911_API_KEY": "loadtest",
+        "WEBHOOK_URL": "http://127.0.0.1:9/",
+        "SUPABASE_URL": "http://127.0.0.1:9/",
+        "SUPABASE_KEY": "loadtest",
+        "MODEL_PATH": model_path,
+        "EARTH911_BASE_URL": earth911_url,
+        "EARTH911_CACHE_PATH": os.path.join(workdir, "earth911.sqlite3"),
+        "RESPONSE_STORE_PATH": os.path.join(workdir, "gemini_responses.json"),
+        "MATERIAL_TABLE_PATH": os.path.join(workdir, "material_ids.json"),
+        "LOCATION_INDEX_PATH": os.path.join(workdir, "locations.sqlite3"),
+        "ZIP_INDEX_PATH": zip_index_path,
+        "UPLOAD_JOURNAL_DIR": os.path.join(workdir, "upload_journal"),
+        **dict(args.secret)
+    }
+    # AppTest only swaps st.secrets in while a script runs, but the app's background threads (start-up,
+    # refreshers, upload workers) read them later, so the process-wide secrets get the same values
+    global_secrets = Secrets()
+    global_secrets._secrets = secrets
+    st.secrets = global_secrets
+    return secrets, {"gemini": gemini, "supabase": supabase_client}
+
+
+def widget(elements, label):
+    for element in elements:
+        if element.label == label or element.label.startswith(label):
+            return element
+    raise SessionError(f"No widget labelled {label!r}")
+
+
+def run_app(at):
+    at.run()
+    if at.exception:
+        raise SessionError(at.exception[0].message)
+    return at
+
+
+def open_session(secrets, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.secrets.update(secrets)
+    return at
+
+
+# Reloads the page until the model is warm and Analyze is enabled. Returns the seconds it took
+def wait_for_startup(secrets, timeout, startup_timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < startup_timeout:
+        at = run_app(open_session(secrets, timeout))
+        if not widget(at.button, "Analyze").disabled:
+            return time.perf_counter() - start
+        time.sleep(0.5)
+    raise SessionError(f"The model wasn't warm after {startup_timeout}s")
+
+
+# One user: open the page, analyze the photo, then look up drop-off locations. A misclassified photo is
+# contributed from the Locations tab
+def user_session(recorder, secrets, timeout, photo, true_class, zip_code, contribute):
+    at = open_session(secrets, timeout)
+    at.session_state[UPLOAD_KEY] = photo
+    recorder.time("page_load", run_app, at)
+
+    widget(at.button, "Analyze").click()
+    recorder.time("analyze", run_app, at)
+    if "analysis" not in at.session_state:
+        raise SessionError("The analysis didn't finish")
+
+    widget(at.text_input, "Enter your ZIP Code").input(zip_code)
+    if contribute:
+        widget(at.radio, "Was the prediction correct?").set_value("No")
+        recorder.time("locations_form", run_app, at)
+        widget(at.checkbox, "Allow training with my images").check()
+        widget(at.selectbox, "What was the object?").set_value(true_class)
+        recorder.time("locations_form", run_app, at)
+
+    widget(at.button, "See Locations").click()
+    recorder.time("locations", run_app, at)
+    if not at.session_state["locations"]:
+        raise SessionError("The location search returned nothing")
+
+
+# One simulated user in its own process: installs the fakes, waits for the app to warm up, reports ready, then
+# runs sessions back to back from `start` until the step's duration is over and reports what it measured
+def user_process(args, workdir, earth911_url, zip_index_path, corpus, concurrency, index, ready, start, results):
+    try:
+        secrets, services = install_stubs(args, workdir, earth911_url, zip_index_path, index)
+        startup_s = wait_for_startup(secrets, args.timeout, args.startup_timeout)
+    except Exception as e:
+        ready.put((None, f"user {index}: {e!r}"))
+        return
+    ready.put((startup_s, None))
+    start.wait()
+
+    recorder = Recorder()
+    peak_rss = [current_rss_mb()]
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.wait(0.5):
+            peak_rss[0] = max(peak_rss[0], current_rss_mb())
+
+    threading.Thread(target=sample_rss, name="loadtest-rss", daemon=True).start()
+    rng = random.Random(args.seed * 1000 + concurrency * 100 + index)
+    cpu_start = cpu_seconds()
+    deadline = time.perf_counter() + args.step_duration
+    while time.perf_counter() < deadline:
+        true_class, name, data = rng.choice(corpus)
+        zip_code = rng.choice(ZIP_CODES)
+        contribute = rng.random() < args.contribute_rate
+        session_start = time.perf_counter()
+        try:
+            user_session(recorder, secrets, args.timeout, (name, data), true_class, zip_code, contribute)
+        except Exception:
+            recorder.errors["session"] += 1
+        recorder.record("session", time.perf_counter() - session_start)
+    stop.set()
+
+    results.put({
+        "durations": dict(recorder.durations),
+        "errors": dict(recorder.errors),
+        "cpu_s": cpu_seconds() - cpu_start,
+        "rss_mb": current_rss_mb(),
+        "peak_rss_mb": max(peak_rss[0], current_rss_mb()),
+        "gemini_calls": services["gemini"].calls,
+        "contributed_images": len(services["supabase"].tables.get(MANIFEST_TABLE, {}))
+    })
+
+
+# Starts `concurrency` user processes, runs them together for the step's duration once all are warm and
+# summarizes the step. Returns the step and the fake service calls the users made
+def run_step(args, workdir, earth911_url, zip_index_path, corpus, concurrency):
+    context = multiprocessing.get_context("spawn")
+    ready, start, results = context.Queue(), context.Event(), context.Queue()
+    users = [context.Process(target=user_process, name=f"loadtest-user-{index}",
+                             args=(args, workdir, earth911_url, zip_index_path, corpus, concurrency, index,
+                                   ready, start, results))
+             for index in range(concurrency)]
+    for user in users:
+        user.start()
+
+    try:
+        startup_s = 0.0
+        for _ in users:
+            seconds, error = ready.get(timeout=args.startup_timeout + 60)
+            if error is not None:
+                raise SessionError(f"A user process didn't start: {error}")
+            startup_s = max(startup_s, seconds)
+
+        start.set()
+        wall_start = time.perf_counter()
+        reports = [results.get(timeout=args.step_duration + args.timeout * 4 + 60) for _ in users]
+        wall = time.perf_counter() - wall_start
+    except Empty:
+        raise SessionError(f"The user processes of the {concurrency} user step stopped responding")
+    finally:
+        for user in users:
+            user.join(timeout=10)
+            if user.is_alive():
+                user.terminate()
+
+    recorder = Recorder()
+    for report in reports:
+        for stage, durations in report["durations"].items():
+            recorder.durations[stage].extend(durations)
+        for stage, errors in report["errors"].items():
+            recorder.errors[stage] += errors
+
+    stages = recorder.summary()
+    sessions = stages.get("session", {}).get("count", 0)
+    errors = stages.get("session", {}).get("errors", 0)
+    step = {
+        "concurrency": concurrency,
+        "startup_s": startup_s,
+        "sessions": sessions,
+        "errors": errors,
+        "error_rate": errors / sessions if sessions else 0.0,
+        "sessions_per_s": sessions / wall,
+        "cpu_percent": sum(report["cpu_s"] for report in reports) / wall * 100,
+        "rss_mb": sum(report["rss_mb"] for report in reports),
+        "peak_rss_mb": sum(report["peak_rss_mb"] for report in reports),
+        "stages": stages
+    }
+    calls = {"gemini_calls": sum(report["gemini_calls"] for report in reports),
+             "contributed_images": sum(report["contributed_images"] for report in reports)}
+    return step, calls
+
+
+def print_step(step):
+    def p95(stage):
+        return step["stages"].get(stage, {}).get("p95_ms") or 0.0
+
+    session = step["stages"].get("session", {})
+    print(f"{step['concurrency']:>6}{step['sessions']:>10}{step['sessions_per_s']:>10.2f}{step['error_rate']:>9.1%}"
+          f"{session.get('p50_ms') or 0.0:>11.0f}{session.get('p95_ms') or 0.0:>11.0f}"
+          f"{session.get('p99_ms') or 0.0:>11.0f}{p95('analyze'):>13.0f}{p95('locations'):>15.0f}"
+          f"{step['cpu_percent']:>8.0f}{step['peak_rss_mb']:>10.0f}")
+
+
+def parse_secret(value):
+    key, _, raw = value.partition("=")
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp up concurrent headless sessions of the Streamlit app")
+    parser.add_argument("--steps", default="1,2,4,8,16", help="Comma-separated concurrent sessions per step")
+    parser.add_argument("--step-duration", type=float, default=30, help="Seconds each step runs for")
+    parser.add_argument("--timeout", type=float, default=60, help="Longest a single script run may take")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--max-p95-s", type=float, help="Stop ramping once the session p95 exceeds this")
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="Stop ramping above this error rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", default="cache/benchmark_corpus")
+    parser.add_argument("--per-class", type=int, default=2, help="Sample images generated per class")
+    parser.add_argument("--contribute-rate", type=float, default=0.2,
+                        help="Share of sessions that report their photo as misclassified")
+    parser.add_argument("--model", help="Real model artifact to use instead of the fake backend")
+    parser.add_argument("--model-ms", type=float, default=40, help="Fake backend cost per batch")
+    parser.add_argument("--model-image-ms", type=float, default=5, help="Fake backend cost per image")
+    parser.add_argument("--gemini-ttft-ms", type=float, default=600)
+    parser.add_argument("--gemini-chunk-ms", type=float, default=50)
+    parser.add_argument("--earth911-ms", type=float, default=150)
+    parser.add_argument("--supabase-ms", type=float, default=120)
+    parser.add_argument("--jitter", type=float, default=0.25, help="Latency standard deviation as a share of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake service calls that fail")
+    parser.add_argument("--secret", type=parse_secret, action="append", default=[], metavar="KEY=VALUE",
+                        help="App setting for the run, e.g. --secret INFERENCE_WORKERS=2 (values are parsed as JSON)")
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    corpus = [(class_name, os.path.basename(path), open(path, "rb").read()) for class_name, path in
+              sample_corpus(args.corpus_dir, per_class=args.per_class, seed=args.seed)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        earth911 = FakeEarth911Server(
+            default_latency=Latency(args.earth911_ms, args.earth911_ms * args.jitter, args.error_rate, seed=4)
+        )
+        # The ZIP codes sessions search for, at the coordinates the fake Earth911 returns, so start-up doesn't
+        # download the Census file
+        zip_index_path = os.path.join(workdir, "zip_centroids.npy")
+        ZipIndex.build([(int(zip_code), *earth911.postal_coordinates(zip_code)) for zip_code in ZIP_CODES],
+                       zip_index_path)
+
+        print(f"{'users':>6}{'sessions':>10}{'per s':>10}{'errors':>9}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}"
+              f"{'analyze p95':>13}{'locations p95':>15}{'CPU %':>8}{'RSS MB':>10}")
+        steps = []
+        calls = {"gemini_calls": 0, "contributed_images": 0}
+        saturated_at = None
+        for concurrency in (int(step) for step in args.steps.split(",")):
+            step, step_calls = run_step(args, workdir, earth911.base_url, zip_index_path, corpus, concurrency)
+            steps.append(step)
+            for key, value in step_calls.items():
+                calls[key] += value
+            print_step(step)
+
+            session_p95 = (step["stages"].get("session", {}).get("p95_ms") or 0.0) / 1000
+            if step["error_rate"] > args.max_error_rate or (args.max_p95_s and session_p95 > args.max_p95_s):
+                saturated_at = concurrency
+                print(f"Stopping: {concurrency} concurrent sessions exceed the latency or error budget")
+                break
+
+        results = {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config": {key: value for key, value in vars(args).items() if key != "out"},
+            "saturated_at": saturated_at,
+            "steps": steps,
+            "services": {"earth911_calls": earth911.calls, **calls}
+        }
+        earth911.close()
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+import argparse
+
+from earth911 import BASE_URL, Earth911Client, MaterialTable, all_specific_items
+
+# Resolves every item name in the Locations tab to its Earth911 material ID ahead of time
+#
+#   EARTH911_API_KEY=... python -m tools.resolve_materials
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve item names to Earth911 material IDs")
+    parser.add_argument("--api-key", default=os.environ.get("EARTH911_API_KEY"), help="Earth911 API key")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--out", default="cache/material_ids.json", help="Material table to update")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--force", action="store_true", help="Look up names that are still fresh too")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("an API key is required (--api-key or EARTH911_API_KEY)")
+
+    table = MaterialTable(Earth911Client(args.api_key, base_url=args.base_url, pool_size=args.workers), path=args.out)
+    resolved, failed = table.resolve_all(all_specific_items(), max_workers=args.workers, force=args.force)
+    print(f"Resolved {resolved} item names into {args.out}")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
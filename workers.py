@@ -0,0 +1,184 @@
+import os
+import atexit
+import queue
+import logging
+import threading
+import multiprocessing
+from functools import partial
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from inference import IMG_SIZE, class_names, load_backend
+
+logger = logging.getLogger(__name__)
+
+# Bytes for one float32 224x224x3 image, the largest input any backend takes
+IMAGE_BYTES = IMG_SIZE * IMG_SIZE * 3 * np.dtype(np.float32).itemsize
+
+
+def _load_keras_model(model_path):
+    import keras
+    return keras.models.load_model(model_path)
+
+
+# Splits the CPUs this process may use into `workers` contiguous groups
+def spread_affinity(workers):
+    cpus = sorted(os.sched_getaffinity(0))
+    size = max(1, len(cpus) // workers)
+    return [cpus[i * size:(i + 1) * size] or cpus for i in range(workers)]
+
+
+# Runs in the worker process: loads the model once, then answers batches written to its shared memory
+def _serve(conn, input_name, output_name, max_batch, backend_options, intra_op_threads, cpus):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+    import tensorflow as tf
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    input_memory = shared_memory.SharedMemory(name=input_name)
+    output_memory = shared_memory.SharedMemory(name=output_name)
+    try:
+        model_path = backend_options.pop("model_path")
+        backend = load_backend(
+            backend_options.pop("name"), model_path, partial(_load_keras_model, model_path),
+            num_threads=intra_op_threads, **backend_options
+        )
+        input_dtype = np.dtype(backend.input_dtype)
+        outputs = np.ndarray((max_batch, len(class_names)), dtype=np.float32, buffer=output_memory.buf)
+        conn.send(("ready", (input_dtype.str, backend.name)))
+
+        while True:
+            count = conn.recv()
+            if count is None:
+                break
+            # A view of the parent's tensors, nothing is copied on the way in
+            batch = np.ndarray((count, IMG_SIZE, IMG_SIZE, 3), dtype=input_dtype, buffer=input_memory.buf)
+            try:
+                outputs[:count] = backend.predict(batch)
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+            else:
+                conn.send(("ok", count))
+    except Exception as e:
+        logger.exception("Inference worker failed")
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        input_memory.close()
+        output_memory.close()
+
+
+class _Worker:
+    def __init__(self, index, context, max_batch, backend_options, intra_op_threads, cpus):
+        self.index = index
+        self.max_batch = max_batch
+        self.input_memory = shared_memory.SharedMemory(create=True, size=max_batch * IMAGE_BYTES)
+        self.output_memory = shared_memory.SharedMemory(create=True, size=max_batch * len(class_names) * 4)
+        self.outputs = np.ndarray((max_batch, len(class_names)), dtype=np.float32, buffer=self.output_memory.buf)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_serve,
+            args=(child_conn, self.input_memory.name, self.output_memory.name, max_batch, dict(backend_options),
+                  intra_op_threads, cpus),
+            name="inference-worker",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def wait_ready(self):
+        status, detail = self.conn.recv()
+        if status != "ready":
+            raise RuntimeError(f"Inference worker failed to start: {detail}")
+        self.input_dtype = np.dtype(detail[0])
+        self.backend_name = detail[1]
+
+    def predict(self, batch):
+        count = len(batch)
+        view = np.ndarray((count, IMG_SIZE, IMG_SIZE, 3), dtype=self.input_dtype, buffer=self.input_memory.buf)
+        view[...] = batch
+        self.conn.send(count)
+        status, detail = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Inference worker error: {detail}")
+        return self.outputs[:count].copy()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        for memory in (self.input_memory, self.output_memory):
+            memory.close()
+            memory.unlink()
+
+
+# Runs the model in a pool of local processes so inference never holds the server's GIL. Images go to the
+# workers through shared memory, and each call uses whichever worker is free, so concurrent callers (several
+# BatchScheduler threads, bulk classification) run on separate cores
+class ProcessBackend:
+    def __init__(self, backend_name, model_path, workers=2, max_batch=32, intra_op_threads=None, cpu_affinity=None,
+                 **backend_options):
+        self.max_batch = max_batch
+        self.intra_op_threads = intra_op_threads
+        self.cpu_affinity = spread_affinity(workers) if cpu_affinity == "spread" else cpu_affinity
+        self.restarts = 0
+        self._options = {"name": backend_name, "model_path": model_path, **backend_options}
+        self._context = multiprocessing.get_context("spawn")
+
+        # The first worker may convert and check a TFLite artifact, so it finishes before the others read it
+        self._workers = [self._start(0)]
+        self._workers[0].wait_ready()
+        self._workers += [self._start(i) for i in range(1, workers)]
+        for worker in self._workers[1:]:
+            worker.wait_ready()
+        # Named after the engine the workers actually run, which can differ if TFLite fell back to Keras
+        self.name = self._workers[0].backend_name
+        self.input_dtype = self._workers[0].input_dtype.type
+
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        self._closed = False
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self, index):
+        cpus = self.cpu_affinity[index % len(self.cpu_affinity)] if self.cpu_affinity else None
+        return _Worker(index, self._context, self.max_batch, self._options, self.intra_op_threads, cpus)
+
+    def predict(self, batch):
+        if len(batch) > self.max_batch:
+            return np.concatenate([self.predict(batch[i:i + self.max_batch])
+                                   for i in range(0, len(batch), self.max_batch)])
+        worker = self._idle.get()
+        try:
+            return worker.predict(batch)
+        except (EOFError, OSError) as e:
+            # A worker that died (e.g. killed for memory) is replaced so the pool keeps its size
+            logger.error("Inference worker %d died, restarting it", worker.index)
+            worker.close()
+            worker = self._workers[worker.index] = self._start(worker.index)
+            worker.wait_ready()
+            self.restarts += 1
+            raise RuntimeError("Inference worker died") from e
+        finally:
+            self._idle.put(worker)
+
+    def stats(self):
+        return {"workers": len(self._workers), "idle": self._idle.qsize(), "restarts": self.restarts}
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for worker in self._workers:
+            worker.close()